@@ -0,0 +1,152 @@
+# asc_files.py
+# The functions in script are called on by "regionalization.py" and "user_inputs.py"
+# They read ESRI ASCII grid (.asc) files directly, so that the .asc files
+# do not need to be copy pasted into an excel workbook first
+
+import os
+import csv
+import numpy as np
+
+
+##############################################################################
+# functions for reading .asc files
+##############################################################################
+
+# keys used for the header dictionary (same as get_file_header in regionalization.py)
+# every .asc file starts with these 6 lines, e.g. "ncols 1234"
+asc_header_keys = {
+    "ncols"         :   "ncols",
+    "nrows"         :   "nrows",
+    "xllcorner"     :   "xllcorner",
+    "yllcorner"     :   "yllcorner",
+    "xllcenter"     :   "xllcorner",
+    "yllcenter"     :   "yllcorner",
+    "cellsize"      :   "cellsize",
+    "nodata_value"  :   "nodata_value"
+}
+num_asc_header_lines = 6
+
+
+# returns the text as an int if possible, otherwise as a float
+# (the same types that excel gives when the .asc file is pasted in)
+def to_number(text):
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
+
+
+# reads the 6 header lines from an open .asc file
+# returns a dictionary with the header (see get_file_header) and
+# a list with the labels in the first column of the header
+def read_asc_header_lines(file, filename):
+    file_header = {}
+    header_labels = []
+    centered = []
+    for line_num in range(num_asc_header_lines):
+        line = file.readline().split()
+        if len(line) != 2 or line[0].lower() not in asc_header_keys:
+            raise ValueError("Line " + str(line_num + 1) + " of '" + filename +
+                             "' is not a valid .asc header line")
+        label = line[0]
+        key = asc_header_keys[label.lower()]
+        file_header[key] = to_number(line[1])
+        if label.lower() in ("xllcenter", "yllcenter"):
+            centered.append(key)
+            label = key
+        header_labels.append(label)
+
+    # header uses the bottom left corner, so move centers by half a cell
+    for key in centered:
+        file_header[key] -= file_header["cellsize"] / 2
+
+    return file_header, header_labels
+
+
+# returns the header dictionary and header labels of an .asc file
+def read_asc_header(filename):
+    with open(filename, 'r') as file:
+        return read_asc_header_lines(file, filename)
+
+
+# returns the header dictionary, header labels, and values of an .asc file
+# values (excluding the header) are returned as a 2D float array
+def read_asc_file(filename):
+    with open(filename, 'r') as file:
+        file_header, header_labels = read_asc_header_lines(file, filename)
+        values = np.fromstring(file.read(), sep=' ')
+
+    ncols = file_header["ncols"]
+    nrows = file_header["nrows"]
+    if values.size != ncols * nrows:
+        raise ValueError("'" + filename + "' has " + str(values.size) + " values, " +
+                         "but the header says it has " + str(ncols * nrows))
+    return file_header, header_labels, values.reshape(nrows, ncols)
+
+
+# returns the rows of an .asc file (excluding the header) one at a time, as float arrays
+# the file is read as rows are needed, so the whole file is never in memory
+def iter_asc_rows(filename):
+    with open(filename, 'r') as file:
+        file_header, header_labels = read_asc_header_lines(file, filename)
+        ncols = file_header["ncols"]
+        values = np.empty(0)
+        for line in file:
+            # a row of the grid can be split over more than one line
+            values = np.concatenate((values, np.fromstring(line, sep=' ')))
+            while values.size >= ncols:
+                yield values[:ncols]
+                values = values[ncols:]
+
+
+# this function writes the header rows of an .asc file into an open file
+# header_labels are the names in the first column of the header (see read_asc_header)
+def write_asc_header(file, file_header, header_labels):
+    for num, key in enumerate(file_header):
+        file.write(str(header_labels[num]) + " " + str(file_header[key]) + "\n")
+
+
+# this function writes rows of values (2D array) of an .asc file into an open file
+# (after write_asc_header, and can be called again for the next rows)
+def write_asc_values(file, values):
+    if np.issubdtype(values.dtype, np.integer):
+        value_format = '%d'
+    else:
+        value_format = '%.10g'
+    np.savetxt(file, values, fmt=value_format, delimiter=' ')
+
+
+# this function writes an .asc file with the header and values (2D array)
+# header_labels are the names in the first column of the header (see read_asc_header)
+def write_asc_file(filename, file_header, header_labels, values):
+    with open(filename, 'w') as file:
+        write_asc_header(file, file_header, header_labels)
+        write_asc_values(file, values)
+
+
+# returns the names of all .asc files in the directory (without .asc, or .ASC...),
+# as a dictionary name --> file name
+def get_asc_names(directory):
+    names = {}
+    for filename in os.listdir(directory):
+        name, extension = os.path.splitext(filename)
+        # if both R1.asc and R1.ASC exist, R1.asc is used
+        if extension.lower() == ".asc" and (name not in names or extension == ".asc"):
+            names[name] = filename
+    return dict(sorted(names.items()))
+
+
+# returns the rows of a 'list.csv' file (region number in column 1,
+# region name in column 2, then any parent regions), this is the same as the sheet 'list'
+def read_list_file(filename):
+    rows = []
+    with open(filename, 'r', newline='') as file:
+        for row in csv.reader(file):
+            if len(row) < 2:
+                continue
+            try:
+                num = to_number(row[0].strip())
+            except ValueError:
+                continue # e.g. a title row
+            rows.append((num,) + tuple(value.strip() for value in row[1:]))
+    return rows
@@ -0,0 +1,176 @@
+# batch.py
+# Makes the regionalized maps of many areas (each its own job) in one run,
+# with the jobs shared between a pool of worker processes
+#
+# Run using:
+#   python batch.py manifest.yaml
+
+#####################################################################
+"""
+The manifest is a .json, .toml or .yaml/.yml file with a list of jobs,
+and (optionally) the number of worker processes:
+    workers: 4
+    jobs:
+      - {name: CAN, input: canada.xlsx, area_name: CAN, regions: list}
+      - {name: BC, input: bc_regions, area_name: BC, format_map: true}
+
+Each job has the same keys as a job file of "regionalization.py" (see README.md),
+and a name (the area name if not given). The files of each job are saved in its own
+'output_directory' (default 'Outputs/[name]'), with everything it printed in 'log.txt'.
+
+Jobs are started largest first (ncols * nrows of the area), so that the largest maps
+do not start last. A job that fails does not stop the other jobs, and the result
+of every job is saved in 'batch_report.json'.
+"""
+##############################################################################
+import os
+import sys
+import json
+import time
+import argparse
+import traceback
+import contextlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from user_inputs import (load_job_file, define_all_variables_from_job, load_input_source,
+                         close_input_source, get_input_cache, get_job_option)
+import regionalization as rg
+
+
+##############################################################################
+# functions for the manifest
+##############################################################################
+
+# returns the jobs (name, job) and number of workers from a manifest file
+# problems with the manifest raise a ValueError
+def load_manifest(manifest_filename):
+    manifest = load_job_file(manifest_filename)
+    if not isinstance(manifest.get("jobs"), list):
+        raise ValueError("The manifest '" + manifest_filename + "' has no list of 'jobs'")
+
+    jobs = []
+    names = set()
+    for job in manifest["jobs"]:
+        job = dict(job)
+        name = str(job.pop("name", job.get("area_name")))
+        if name in names:
+            raise ValueError("There is more than one job with the name '" + name + "'")
+        names.add(name)
+        if job.get("output_directory") is None:
+            job["output_directory"] = os.path.join("Outputs", name)
+        jobs.append((name, job))
+
+    return jobs, int(manifest.get("workers", 1))
+
+
+# returns the number of cells (ncols * nrows) of the area of a job
+# only the header of the area is read, and 0 is returned if it cannot be read
+# (the job then fails when it is run, with the reason in its log)
+def get_job_size(job):
+    try:
+        source = load_input_source(job.get("input", rg.default_xlFilename), quiet=True,
+                                   input_cache=get_input_cache(job))
+        try:
+            area_header, area_header_labels = rg.read_grid_header(source, job["area_name"])
+        finally:
+            close_input_source(source)
+        return area_header["ncols"] * area_header["nrows"]
+    except Exception:
+        return 0
+
+
+##############################################################################
+# functions for running jobs
+##############################################################################
+
+# this function is run by the worker processes
+# it makes and saves the map of one job, with everything printed saved in 'log.txt'
+# in the output folder of the job, and returns the result of the job
+def run_batch_job(name, job):
+    start_time = time.perf_counter()
+    output_directory = get_job_option(job, "output_directory")
+    if not os.path.exists(output_directory):
+        os.makedirs(output_directory)
+
+    result = {"name": name, "output_directory": output_directory, "status": "finished", "error": None}
+    with open(os.path.join(output_directory, "log.txt"), 'w') as log_file:
+        with contextlib.redirect_stdout(log_file):
+            try:
+                start = rg.start_measure()
+                variables = define_all_variables_from_job(job)
+                rg.make_and_save_map(variables, job, start)
+            except (Exception, SystemExit) as error:
+                traceback.print_exc(file=log_file)
+                result["status"] = "failed"
+                result["error"] = type(error).__name__ + ": " + str(error)
+
+    result["seconds"] = time.perf_counter() - start_time
+    return result
+
+
+# returns the results of running all jobs (name, job) in a pool of worker processes
+# jobs are started largest first, and a job that fails does not stop the others
+def run_batch(jobs, workers):
+    sizes = {name: get_job_size(job) for name, job in jobs}
+    jobs = sorted(jobs, key=lambda item: sizes[item[0]], reverse=True)
+    print("Running " + str(len(jobs)) + " jobs with " + str(workers) + " worker processes")
+
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        for name, job in jobs:
+            futures[executor.submit(run_batch_job, name, job)] = name
+
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                result = future.result()
+            except Exception as error: # e.g. the worker process was killed
+                result = {"name": name, "output_directory": None, "status": "failed",
+                          "error": type(error).__name__ + ": " + str(error), "seconds": None}
+            result["cells"] = sizes[name]
+            results.append(result)
+            if result["status"] == "failed":
+                print("ERROR: job '" + name + "' failed: " + result["error"])
+            else:
+                print("Now finished job: " + name)
+
+    return results
+
+
+##############################################################################
+# main script
+##############################################################################
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Make the regionalized maps of all jobs " +
+                                                 "in a manifest, in a pool of worker processes.")
+    parser.add_argument("manifest", help="manifest file (.json, .toml, .yaml or .yml) with the jobs")
+    parser.add_argument("--workers", type=int,
+                        help="number of worker processes (default from the manifest, or 1; " +
+                             "0 to use all cpus)")
+    parser.add_argument("--report", default="batch_report.json",
+                        help="file to save the result of every job in (default batch_report.json)")
+    args = parser.parse_args(argv)
+
+    try:
+        jobs, workers = load_manifest(args.manifest)
+    except (ValueError, OSError) as error:
+        sys.exit("ERROR: " + str(error))
+    if args.workers is not None:
+        workers = args.workers
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+
+    results = run_batch(jobs, workers)
+    with open(args.report, 'w') as file:
+        json.dump(results, file, indent=2)
+
+    num_failed = sum(result["status"] == "failed" for result in results)
+    print("Finished " + str(len(results) - num_failed) + " of " + str(len(results)) + " jobs " +
+          "(see " + args.report + ")")
+    if num_failed > 0:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
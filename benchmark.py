@@ -0,0 +1,281 @@
+# benchmark.py
+# Times each stage of "regionalization.py" on a synthetic area and regions,
+# so that changes to the slow parts (reading, adding regions, saving) can be measured
+#
+# Run using:
+#   python benchmark.py --ncols 2000 --nrows 1500 --regions 40
+
+#####################################################################
+"""
+A synthetic area is split into blocks, one block per region. Each block is made
+larger by the overlap fraction (so regions overlap their neighbours), and a
+fraction of the cells in each region are set to the nodata value.
+
+The area and regions are written as an excel workbook and/or a folder of .asc files,
+and then these stages are timed:
+    load workbook                   --> load the input and read every region
+    set_cells_to_num_except_blanks  --> add every region to the map
+    set_blanks_to_nodata            --> set blank cells to the nodata value
+    save_files                      --> save map, legend and overlaps (and formatted map)
+
+For each stage, the time, number of cells, cells per second and peak memory (RSS)
+are printed, and can also be saved as a json file.
+"""
+##############################################################################
+import os
+import sys
+import json
+import math
+import time
+import shutil
+import argparse
+import tempfile
+import numpy as np
+from asc_files import write_asc_file
+import regionalization as rg
+
+
+##############################################################################
+# functions for making synthetic inputs
+##############################################################################
+
+# returns a header dictionary (same keys as get_file_header)
+def make_header(ncols, nrows, xllcorner, yllcorner, cellsize, nodata_value):
+    file_header = {
+        "ncols"         :   ncols,
+        "nrows"         :   nrows,
+        "xllcorner"     :   xllcorner,
+        "yllcorner"     :   yllcorner,
+        "cellsize"      :   cellsize,
+        "nodata_value"  :   nodata_value
+    }
+    return file_header
+
+
+# returns the area header, and a dictionary of region name --> (header, values)
+# regions are blocks of the area, made larger by overlap_fraction of their size,
+# with nodata_fraction of their cells set to the nodata value
+def make_synthetic_grids(ncols, nrows, cellsize, num_regions, overlap_fraction, nodata_fraction,
+                         seed=0):
+    rng = np.random.default_rng(seed)
+    nodata_value = -9999
+    area_header = make_header(ncols, nrows, 100000, 200000, cellsize, nodata_value)
+
+    # split the area into a grid of blocks, about as many blocks as regions
+    num_block_cols = max(1, int(math.ceil(math.sqrt(num_regions * ncols / nrows))))
+    num_block_rows = int(math.ceil(num_regions / num_block_cols))
+    block_ncols = int(math.ceil(ncols / num_block_cols))
+    block_nrows = int(math.ceil(nrows / num_block_rows))
+    extra_cols = int(round(block_ncols * overlap_fraction))
+    extra_rows = int(round(block_nrows * overlap_fraction))
+
+    regions = {}
+    for num in range(num_regions):
+        top_row = (num // num_block_cols) * block_nrows
+        left_col = (num % num_block_cols) * block_ncols
+        region_nrows = min(block_nrows + extra_rows, nrows - top_row)
+        region_ncols = min(block_ncols + extra_cols, ncols - left_col)
+        if region_nrows <= 0 or region_ncols <= 0:
+            continue
+        region_header = make_header(region_ncols, region_nrows,
+                                    area_header["xllcorner"] + left_col * cellsize,
+                                    area_header["yllcorner"] + (nrows - top_row - region_nrows) * cellsize,
+                                    cellsize, nodata_value)
+        values = np.where(rng.random((region_nrows, region_ncols)) < nodata_fraction, nodata_value, 1)
+        regions["R" + str(num + 1)] = (region_header, values)
+
+    return area_header, regions
+
+
+# header labels used when writing synthetic inputs
+header_labels = ["ncols", "nrows", "xllcorner", "yllcorner", "cellsize", "NODATA_value"]
+
+
+# this function writes the area and regions as an excel workbook (one sheet each)
+# with a sheet 'list' of all regions
+def write_synthetic_workbook(filename, area_name, area_header, regions):
+    from openpyxl import Workbook
+    wb = Workbook(write_only=True)
+    grids = {area_name: (area_header, np.ones((area_header["nrows"], area_header["ncols"]), dtype=int))}
+    grids.update(regions)
+    for name in grids:
+        file_header, values = grids[name]
+        ws = wb.create_sheet(name)
+        for num, key in enumerate(file_header):
+            ws.append([header_labels[num], file_header[key]])
+        left_cols = [None] * rg.num_extra_left_cols
+        for row in values.tolist():
+            ws.append(left_cols + row)
+    list_ws = wb.create_sheet("list")
+    for num, name in enumerate(regions, 1):
+        list_ws.append([num, name])
+    wb.save(filename)
+
+
+# this function writes the area and regions as a folder of .asc files, with 'list.csv'
+def write_synthetic_asc_files(directory, area_name, area_header, regions):
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    write_asc_file(os.path.join(directory, area_name + ".asc"), area_header, header_labels,
+                   np.ones((area_header["nrows"], area_header["ncols"]), dtype=int))
+    for name in regions:
+        file_header, values = regions[name]
+        write_asc_file(os.path.join(directory, name + ".asc"), file_header, header_labels, values)
+    with open(os.path.join(directory, "list.csv"), 'w') as file:
+        for num, name in enumerate(regions, 1):
+            file.write(str(num) + "," + name + "\n")
+
+
+##############################################################################
+# functions for timing
+##############################################################################
+
+# returns the peak memory (RSS) of this process so far in megabytes, or None if unknown
+def get_peak_rss_megabytes():
+    try:
+        import resource
+    except ImportError: # not available on windows
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin": # bytes on macOS, kilobytes on linux
+        peak_rss /= 1024
+    return peak_rss / 1024
+
+
+# returns the result of calling function, and adds the time it took to results
+def time_stage(results, stage, num_cells, function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    seconds = time.perf_counter() - start
+    results.append({
+        "stage"             :   stage,
+        "seconds"           :   seconds,
+        "cells"             :   num_cells,
+        "cells_per_second"  :   num_cells / seconds if seconds > 0 else None,
+        "peak_rss_mb"       :   get_peak_rss_megabytes()
+    })
+    return result
+
+
+# returns the grids of every region read from the source (see read_grid)
+def read_all_regions(source, regions):
+    return {num: rg.read_grid(source, regions[num]) for num in regions}
+
+
+# this function adds every region that was read to the map
+def add_all_regions(grids, label_map, area_header, area_cell_info, overlaps):
+    for num in grids:
+        region_header, region_header_labels, region_values = grids[num]
+        region_cell_info = rg.get_region_cell_info(region_header, area_header, area_cell_info)
+        rg.set_cells_to_num_except_blanks(label_map, region_values, region_header,
+                                          region_cell_info, num, overlaps)
+
+
+# returns the timing results of running each stage on one input (workbook or folder)
+def run_stages(input_name, area_name, format_map, output_directory):
+    results = []
+    source = time_stage(results, "load input", 0, rg.load_input_source, input_name, True)
+    regions = {}
+    for row in rg.read_list_rows(source):
+        regions[row[0]] = row[1]
+    area_header, area_header_labels = rg.read_grid_header(source, area_name)
+    area_cell_info = rg.get_area_cell_info(area_header)
+    area_cells = area_header["ncols"] * area_header["nrows"]
+
+    region_cells = 0
+    for num in regions:
+        region_header, region_header_labels = rg.read_grid_header(source, regions[num])
+        region_cells += region_header["ncols"] * region_header["nrows"]
+
+    grids = time_stage(results, "load workbook", region_cells, read_all_regions, source, regions)
+    rg.close_input_source(source)
+
+    label_map = rg.create_label_map(area_header, dtype=rg.get_label_dtype(regions))
+    overlaps = rg.create_overlaps(label_map, regions)
+    time_stage(results, "set_cells_to_num_except_blanks", region_cells, add_all_regions,
+               grids, label_map, area_header, area_cell_info, overlaps)
+    del grids
+
+    time_stage(results, "set_blanks_to_nodata", area_cells, rg.set_blanks_to_nodata,
+               label_map, area_header)
+
+    time_stage(results, "save_files", area_cells, rg.save_files, label_map, area_header,
+               area_header_labels, area_cell_info, regions, overlaps, "formatted_map.xlsx",
+               dict(rg.default_save_csv_names), format_map, "cells", None, output_directory)
+
+    return results
+
+
+# this function prints the timing results as a table
+def print_results(input_format, results):
+    print("\n" + input_format)
+    print("{:<32} {:>10} {:>14} {:>14} {:>14}".format("stage", "seconds", "cells",
+                                                     "cells/second", "peak RSS (MB)"))
+    for result in results:
+        cells_per_second = result["cells_per_second"]
+        peak_rss = result["peak_rss_mb"]
+        print("{:<32} {:>10.3f} {:>14} {:>14} {:>14}".format(
+            result["stage"], result["seconds"], result["cells"],
+            "-" if not cells_per_second else "{:.0f}".format(cells_per_second),
+            "-" if peak_rss is None else "{:.1f}".format(peak_rss)))
+
+
+##############################################################################
+# main script
+##############################################################################
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time each stage of regionalization.py " +
+                                                 "on a synthetic area and regions.")
+    parser.add_argument("--ncols", type=int, default=1000, help="columns of the area")
+    parser.add_argument("--nrows", type=int, default=800, help="rows of the area")
+    parser.add_argument("--cellsize", type=float, default=1000, help="size of each cell")
+    parser.add_argument("--regions", type=int, default=20, help="number of regions")
+    parser.add_argument("--overlap", type=float, default=0.05,
+                        help="fraction of its size that each region overlaps its neighbours")
+    parser.add_argument("--nodata", type=float, default=0.1,
+                        help="fraction of cells in each region with the nodata value")
+    parser.add_argument("--inputs", choices=("xlsx", "asc", "both"), default="both",
+                        help="input formats to time")
+    parser.add_argument("--format-map", dest="format_map", action="store_true",
+                        help="also time saving the formatted map")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the random nodata cells")
+    parser.add_argument("--json", help="save the results in this json file")
+    parser.add_argument("--keep", help="keep the synthetic inputs and outputs in this folder")
+    args = parser.parse_args(argv)
+
+    directory = args.keep or tempfile.mkdtemp(prefix="regionalization_benchmark_")
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    area_name = "AREA"
+
+    print("Making synthetic area (" + str(args.ncols) + " x " + str(args.nrows) + ") with " +
+          str(args.regions) + " regions in: " + directory)
+    area_header, regions = make_synthetic_grids(args.ncols, args.nrows, args.cellsize, args.regions,
+                                                args.overlap, args.nodata, args.seed)
+
+    inputs = {}
+    if args.inputs in ("xlsx", "both"):
+        inputs["xlsx"] = os.path.join(directory, "synthetic_regions.xlsx")
+        write_synthetic_workbook(inputs["xlsx"], area_name, area_header, regions)
+    if args.inputs in ("asc", "both"):
+        inputs["asc"] = os.path.join(directory, "synthetic_regions")
+        write_synthetic_asc_files(inputs["asc"], area_name, area_header, regions)
+
+    report = {"settings": vars(args), "results": {}}
+    for input_format in inputs:
+        output_directory = os.path.join(directory, "outputs_" + input_format)
+        results = run_stages(inputs[input_format], area_name, args.format_map, output_directory)
+        report["results"][input_format] = results
+        print_results(input_format, results)
+
+    if args.json is not None:
+        with open(args.json, 'w') as file:
+            json.dump(report, file, indent=2)
+
+    if args.keep is None:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+# input_cache.py
+# The functions in script are called on by "regionalization.py" and "user_inputs.py"
+# They keep the parsed sheets (or .asc files) of input files in a folder on disk,
+# so that running again with the same input file does not need to parse it again
+
+import os
+import json
+import hashlib
+import numpy as np
+
+
+##############################################################################
+# functions for the input cache
+##############################################################################
+
+# returns a dictionary with the settings of the cache
+# the cache keeps at most max_megabytes of files in directory
+def create_input_cache(directory, max_megabytes):
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    input_cache = {
+        "directory"     :   directory,
+        "max_bytes"     :   int(max_megabytes * 1024 * 1024)
+    }
+    remove_old_entries(input_cache)
+    return input_cache
+
+
+# returns the name of the cache entry for a sheet of a file
+# the entry changes whenever the file is changed (different size or modification time)
+def get_entry_name(filename, name):
+    stat = os.stat(filename)
+    key = "\n".join([os.path.abspath(filename), str(stat.st_size), str(stat.st_mtime_ns), name])
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+# returns the path of a file of a cache entry
+def get_entry_path(input_cache, entry_name, extension):
+    return os.path.join(input_cache["directory"], entry_name + extension)
+
+
+# this function marks the files of a cache entry as just used (for removing old entries)
+def touch_entry(input_cache, entry_name, extensions):
+    for extension in extensions:
+        try:
+            os.utime(get_entry_path(input_cache, entry_name, extension))
+        except FileNotFoundError:
+            pass
+
+
+# this function writes a file of a cache entry, so that it appears all at once
+# (other processes never see a file that is only partly written)
+def write_entry_file(input_cache, entry_name, extension, write):
+    path = get_entry_path(input_cache, entry_name, extension)
+    temp_path = path + "." + str(os.getpid()) + ".tmp"
+    with open(temp_path, 'wb') as file:
+        write(file)
+    os.replace(temp_path, path)
+
+
+# returns the dictionary saved in the .json file of an entry, or None
+def load_entry_json(input_cache, entry_name):
+    try:
+        with open(get_entry_path(input_cache, entry_name, ".json"), 'r') as file:
+            return json.load(file)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+# returns information about a file (e.g. its sheet names) saved in the cache, or None
+def load_cached_info(input_cache, filename, info_name):
+    entry_name = get_entry_name(filename, "info:" + info_name)
+    entry = load_entry_json(input_cache, entry_name)
+    if entry is None:
+        return None
+    touch_entry(input_cache, entry_name, (".json",))
+    return entry["info"]
+
+
+# this function saves information about a file (anything that can be saved as json)
+def save_cached_info(input_cache, filename, info_name, info):
+    entry_name = get_entry_name(filename, "info:" + info_name)
+    text = json.dumps({"info": info})
+    write_entry_file(input_cache, entry_name, ".json", lambda file: file.write(text.encode("utf-8")))
+    remove_old_entries(input_cache)
+
+
+# returns the header dictionary and header labels of a sheet from the cache, or None
+def load_cached_header(input_cache, filename, name):
+    entry_name = get_entry_name(filename, name)
+    entry = load_entry_json(input_cache, entry_name)
+    if entry is None:
+        return None
+    touch_entry(input_cache, entry_name, (".json",))
+    return entry["header"], entry["header_labels"]
+
+
+# this function saves the header dictionary and header labels of a sheet in the cache
+# (for sheets where only the header is read, e.g. the area)
+def save_cached_header(input_cache, filename, name, file_header, header_labels):
+    entry_name = get_entry_name(filename, name)
+    text = json.dumps({"header": file_header, "header_labels": header_labels})
+    write_entry_file(input_cache, entry_name, ".json", lambda file: file.write(text.encode("utf-8")))
+    remove_old_entries(input_cache)
+
+
+# returns the header dictionary, header labels and values of a sheet from the cache, or None
+def load_cached_grid(input_cache, filename, name):
+    entry_name = get_entry_name(filename, name)
+    entry = load_entry_json(input_cache, entry_name)
+    if entry is None:
+        return None
+    try:
+        with np.load(get_entry_path(input_cache, entry_name, ".npz")) as data:
+            values = data["values"].astype(np.float64)
+    except (FileNotFoundError, ValueError, KeyError, OSError):
+        return None
+    touch_entry(input_cache, entry_name, (".json", ".npz"))
+    return entry["header"], entry["header_labels"], values
+
+
+# this function saves the header dictionary, header labels and values of a sheet in the cache
+# values are saved as float32 when that does not change any value
+def save_cached_grid(input_cache, filename, name, file_header, header_labels, values):
+    entry_name = get_entry_name(filename, name)
+    small_values = values.astype(np.float32)
+    if np.array_equal(small_values, values, equal_nan=True):
+        values = small_values
+    write_entry_file(input_cache, entry_name, ".npz", lambda file: np.savez(file, values=values))
+
+    text = json.dumps({"header": file_header, "header_labels": header_labels})
+    write_entry_file(input_cache, entry_name, ".json", lambda file: file.write(text.encode("utf-8")))
+    remove_old_entries(input_cache)
+
+
+# this function removes the least recently used entries
+# until the cache is no larger than its maximum size
+def remove_old_entries(input_cache):
+    entries = {}
+    total_size = 0
+    for filename in os.listdir(input_cache["directory"]):
+        entry_name, extension = os.path.splitext(filename)
+        if extension not in (".json", ".npz"):
+            continue
+        try:
+            stat = os.stat(os.path.join(input_cache["directory"], filename))
+        except FileNotFoundError:
+            continue
+        size, last_used = entries.get(entry_name, (0, 0))
+        entries[entry_name] = (size + stat.st_size, max(last_used, stat.st_mtime_ns))
+        total_size += stat.st_size
+
+    for entry_name in sorted(entries, key=lambda entry_name: entries[entry_name][1]):
+        if total_size <= input_cache["max_bytes"]:
+            break
+        for extension in (".json", ".npz"):
+            try:
+                os.remove(get_entry_path(input_cache, entry_name, extension))
+            except FileNotFoundError:
+                pass
+        total_size -= entries[entry_name][0]
@@ -0,0 +1,86 @@
+# map_preview.py
+# The functions in script are called on by "regionalization.py"
+# They make small previews of the map (downsampled maps, one for each zoom factor)
+# and save them as .png or .ppm images, using only numpy and the python standard library
+
+import zlib
+import struct
+import colorsys
+import numpy as np
+
+
+##############################################################################
+# functions for downsampling
+##############################################################################
+
+# returns values (2D array of small integers, e.g. region indices) downsampled by factor:
+# each block of factor x factor cells becomes one cell with the most common value of
+# the block (the smallest of them if there is a tie)
+# cells equal to pad_value are not counted (used to fill blocks at the edges of the map)
+def downsample_mode(values, factor, pad_value):
+    nrows = -(-values.shape[0] // factor)
+    ncols = -(-values.shape[1] // factor)
+    padded = np.full((nrows * factor, ncols * factor), pad_value, dtype=values.dtype)
+    padded[:values.shape[0], :values.shape[1]] = values
+
+    # one row for each block, with the cells of the block sorted
+    block_size = factor * factor
+    blocks = padded.reshape(nrows, factor, ncols, factor).transpose(0, 2, 1, 3)
+    sorted_cells = np.sort(blocks.reshape(-1, block_size), axis=1).ravel()
+
+    # runs of the same value in each block, and the longest run of each block
+    new_run = np.ones(sorted_cells.size, dtype=bool)
+    new_run[1:] = sorted_cells[1:] != sorted_cells[:-1]
+    new_run[::block_size] = True
+    run_starts = np.flatnonzero(new_run)
+    run_lengths = np.diff(np.append(run_starts, sorted_cells.size))
+    run_lengths[sorted_cells[run_starts] == pad_value] = 0
+    run_blocks = run_starts // block_size
+    order = np.lexsort((-run_lengths, run_blocks))
+    first_runs = order[np.flatnonzero(np.diff(run_blocks[order], prepend=-1))]
+    return sorted_cells[run_starts[first_runs]].reshape(nrows, ncols)
+
+
+##############################################################################
+# functions for images
+##############################################################################
+
+# returns the colours (num_colors x 3 array of red, green, blue) of the regions in a preview
+# neighbouring region numbers get hues far apart, so that neighbouring regions stand out
+def get_preview_colors(num_colors):
+    golden_ratio = 0.618033988749895
+    colors = np.zeros((num_colors, 3), dtype=np.uint8)
+    for num in range(num_colors):
+        hue = (num * golden_ratio) % 1
+        value = 0.95 if num % 2 == 0 else 0.75
+        colors[num] = [round(255 * color) for color in colorsys.hsv_to_rgb(hue, 0.65, value)]
+    return colors
+
+# returns the image (nrows x ncols x 3 array) of a preview, where index is the region index
+# of each cell (see get_preview_colors), and num_colors (or more) is a cell without a region
+def get_preview_image(index, num_colors, empty_color=(255, 255, 255)):
+    colors = np.vstack((get_preview_colors(num_colors), np.array([empty_color], dtype=np.uint8)))
+    return colors[np.minimum(index, num_colors)]
+
+# this function saves an image (nrows x ncols x 3 array of uint8) as a binary .ppm file
+def write_ppm(filename, image):
+    with open(filename, 'wb') as file:
+        file.write(("P6\n" + str(image.shape[1]) + " " + str(image.shape[0]) + "\n255\n").encode())
+        file.write(np.ascontiguousarray(image, dtype=np.uint8).tobytes())
+
+# returns a chunk of a .png file
+def get_png_chunk(chunk_type, data):
+    chunk = chunk_type + data
+    return struct.pack(">I", len(data)) + chunk + struct.pack(">I", zlib.crc32(chunk) & 0xffffffff)
+
+# this function saves an image (nrows x ncols x 3 array of uint8) as a .png file
+def write_png(filename, image):
+    nrows, ncols = image.shape[:2]
+    # every row starts with filter type 0 (no filter)
+    rows = np.zeros((nrows, 1 + ncols * 3), dtype=np.uint8)
+    rows[:, 1:] = image.reshape(nrows, ncols * 3)
+    with open(filename, 'wb') as file:
+        file.write(b"\x89PNG\r\n\x1a\n")
+        file.write(get_png_chunk(b"IHDR", struct.pack(">IIBBBBB", ncols, nrows, 8, 2, 0, 0, 0)))
+        file.write(get_png_chunk(b"IDAT", zlib.compress(rows.tobytes(), 6)))
+        file.write(get_png_chunk(b"IEND", b""))
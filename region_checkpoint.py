@@ -0,0 +1,160 @@
+# region_checkpoint.py
+# The functions in script are called on by "regionalization.py"
+# They save checkpoints while regions are added to the map (the partial map, the overlaps
+# found so far, and which regions are finished), so that a run that stops part way
+# (e.g. out of memory, or the computer restarted) can be resumed from the last checkpoint
+# Checkpoints are saved in two folders in turn, so that the last complete checkpoint
+# is kept even if the program stops while saving the next one
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import numpy as np
+from region_spans import create_spans
+from region_state import (window_to_list, list_to_window, save_map_state, remove_state_info,
+                          load_state_info, load_map_state)
+
+# folders in the checkpoint directory that checkpoints are saved in, in turn
+checkpoint_slots = ("checkpoint_a", "checkpoint_b")
+
+
+##############################################################################
+# functions for saving checkpoints
+##############################################################################
+
+# returns a dictionary to keep track of checkpoints while regions are added to the map:
+#   directory   --> folder that checkpoints are saved in
+#   seconds     --> least time between checkpoints (0 to save one after every region)
+#   run_info    --> what the map is made from (input, area, regions...), anything that can
+#                   be saved as json; a checkpoint is only resumed by a run with the same run_info
+#   finished    --> numbers of regions added to the map so far, in order
+#   last_saved  --> time the last checkpoint was saved
+def create_checkpoint(directory, seconds, run_info, finished=()):
+    checkpoint = {
+        "directory"     :   directory,
+        "seconds"       :   seconds,
+        "run_info"      :   run_info,
+        "finished"      :   list(finished),
+        "last_saved"    :   time.perf_counter()
+    }
+    return checkpoint
+
+
+# returns a hash of the values of an array, used to check that a checkpoint was not changed
+def get_array_hash(array):
+    return hashlib.sha1(np.ascontiguousarray(array)).hexdigest()
+
+
+# this function saves the overlaps found so far (see create_overlaps in "regionalization.py")
+# other than coverage, which is saved with the map
+def save_overlaps(directory, overlaps):
+    cells = [cells for num, cells in overlaps["cells"]]
+    masks = [overlaps["masks"][num] for num in overlaps["masks"]]
+    with open(os.path.join(directory, "overlaps.npz"), 'wb') as file:
+        np.savez(file, pairs=overlaps["pairs"],
+                 cells=np.concatenate(cells) if cells else np.zeros(0, dtype=np.int64),
+                 cell_counts=np.array([len(region_cells) for region_cells in cells], dtype=np.int64),
+                 windows=np.array([window_to_list(window) for window, spans in masks],
+                                  dtype=np.int64).reshape(-1, 4),
+                 span_counts=np.array([len(spans["rows"]) for window, spans in masks],
+                                      dtype=np.int64),
+                 rows=np.concatenate([spans["rows"] for window, spans in masks] or [[]]),
+                 starts=np.concatenate([spans["starts"] for window, spans in masks] or [[]]),
+                 stops=np.concatenate([spans["stops"] for window, spans in masks] or [[]]))
+
+
+# this function saves a checkpoint of label_map and overlaps, in the checkpoint folder
+# that was saved least recently (its old checkpoint is removed first)
+def save_checkpoint(checkpoint, label_map, overlaps):
+    slots = [os.path.join(checkpoint["directory"], slot) for slot in checkpoint_slots]
+    saved = [load_state_info(slot) for slot in slots]
+    # an empty folder first, then the folder with fewer finished regions
+    slot = min(range(len(slots)), key=lambda index: -1 if saved[index] is None
+                                                     else len(saved[index]["finished"]))
+    directory = slots[slot]
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    remove_state_info(directory)
+
+    save_overlaps(directory, overlaps)
+    checkpoint_info = {
+        "run_info"      :   checkpoint["run_info"],
+        "finished"      :   checkpoint["finished"],
+        "cell_nums"     :   [num for num, cells in overlaps["cells"]],
+        "mask_nums"     :   list(overlaps["masks"]),
+        "map_hash"      :   get_array_hash(label_map),
+        "coverage_hash" :   get_array_hash(overlaps["coverage"])
+    }
+    # the information is saved last, so a checkpoint is only used if it was saved completely
+    save_map_state(directory, checkpoint_info, label_map, overlaps["coverage"])
+    checkpoint["last_saved"] = time.perf_counter()
+
+
+# this function records that region num was added to the map,
+# and saves a checkpoint if it has been long enough since the last one
+# does nothing if checkpoint is None
+def add_finished_region(checkpoint, num, label_map, overlaps):
+    if checkpoint is None:
+        return
+    checkpoint["finished"].append(num)
+    if time.perf_counter() - checkpoint["last_saved"] >= checkpoint["seconds"]:
+        save_checkpoint(checkpoint, label_map, overlaps)
+
+
+# this function removes all checkpoints (e.g. once the map is finished)
+def remove_checkpoints(directory):
+    for slot in checkpoint_slots:
+        slot_directory = os.path.join(directory, slot)
+        if os.path.exists(slot_directory):
+            shutil.rmtree(slot_directory)
+
+
+##############################################################################
+# functions for resuming from checkpoints
+##############################################################################
+
+# returns the information of the checkpoint with the most finished regions for run_info,
+# and the folder it is in, or (None, None) if there is no complete checkpoint for run_info
+def find_checkpoint(directory, run_info):
+    # run_info as it is once saved as json (e.g. tuples become lists)
+    run_info = json.loads(json.dumps(run_info))
+    best_info, best_directory = None, None
+    for slot in checkpoint_slots:
+        slot_directory = os.path.join(directory, slot)
+        checkpoint_info = load_state_info(slot_directory)
+        if checkpoint_info is None or checkpoint_info["run_info"] != run_info:
+            continue
+        if best_info is None or len(checkpoint_info["finished"]) > len(best_info["finished"]):
+            best_info, best_directory = checkpoint_info, slot_directory
+    return best_info, best_directory
+
+
+# returns the label_map of a checkpoint found by find_checkpoint, and sets overlaps
+# (made by create_overlaps, before any region was added) to what they were when the
+# checkpoint was saved
+# raises a ValueError if the map or coverage are not the same as when they were saved
+def load_checkpoint(checkpoint_info, directory, overlaps):
+    label_map, coverage = load_map_state(directory)
+    if (get_array_hash(label_map) != checkpoint_info["map_hash"] or 
+            get_array_hash(coverage) != checkpoint_info["coverage_hash"]):
+        raise ValueError("The checkpoint in '" + directory + "' was changed after it was saved")
+    overlaps["coverage"][...] = coverage
+    with np.load(os.path.join(directory, "overlaps.npz")) as data:
+        overlaps["pairs"][...] = data["pairs"]
+        cells = np.split(data["cells"], np.cumsum(data["cell_counts"])[:-1])
+        overlaps["cells"] = [(num, region_cells) for num, region_cells
+                             in zip(checkpoint_info["cell_nums"], cells)]
+
+        span_ends = np.cumsum(data["span_counts"])
+        span_starts = span_ends - data["span_counts"]
+        overlaps["masks"] = {}
+        for index, num in enumerate(checkpoint_info["mask_nums"]):
+            window = list_to_window(data["windows"][index].tolist())
+            shape = (window[0].stop - window[0].start, window[1].stop - window[1].start)
+            spans = slice(span_starts[index], span_ends[index])
+            overlaps["masks"][num] = (window, create_spans(shape, data["rows"][spans],
+                                                           data["starts"][spans],
+                                                           data["stops"][spans]))
+    return label_map
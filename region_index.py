@@ -0,0 +1,75 @@
+# region_index.py
+# The functions in script are called on by "regionalization.py"
+# They keep a spatial index of where each region is in the map (its window),
+# so that only regions whose windows intersect have to be checked for overlaps
+
+import math
+
+
+##############################################################################
+# functions for windows
+##############################################################################
+
+# a window is a tuple (rows, cols) of slices of the map
+
+# returns the part of two windows (in the map) that is in both, or None
+def intersect_windows(window_a, window_b):
+    rows = slice(max(window_a[0].start, window_b[0].start), min(window_a[0].stop, window_b[0].stop))
+    cols = slice(max(window_a[1].start, window_b[1].start), min(window_a[1].stop, window_b[1].stop))
+    if rows.start >= rows.stop or cols.start >= cols.stop:
+        return None
+    return rows, cols
+
+
+##############################################################################
+# functions for the region index
+##############################################################################
+
+# returns the buckets (row, col) of the index that a window touches
+def get_buckets(window, bucket_size):
+    for row in range(window[0].start // bucket_size, (window[0].stop - 1) // bucket_size + 1):
+        for col in range(window[1].start // bucket_size, (window[1].stop - 1) // bucket_size + 1):
+            yield row, col
+
+
+# returns an empty index for a map with the given shape (nrows, ncols)
+# the map is split into square buckets, about one bucket for each region
+def create_region_index(shape, num_regions):
+    bucket_size = max(1, int(math.sqrt(shape[0] * shape[1] / max(num_regions, 1))))
+    region_index = {
+        "bucket_size"   :   bucket_size,
+        "buckets"       :   {},     # (row, col) --> region numbers in bucket
+        "windows"       :   {},     # region number --> window
+        "order"         :   {}      # region number --> order the region was added
+    }
+    return region_index
+
+
+# this function adds the window of a region to the index
+def add_to_region_index(region_index, num, window):
+    if num in region_index["windows"]:
+        remove_from_region_index(region_index, num)
+    region_index["windows"][num] = window
+    region_index["order"][num] = len(region_index["order"])
+    for bucket in get_buckets(window, region_index["bucket_size"]):
+        region_index["buckets"].setdefault(bucket, []).append(num)
+
+
+# this function removes a region from the index
+def remove_from_region_index(region_index, num):
+    window = region_index["windows"].pop(num)
+    del region_index["order"][num]
+    for bucket in get_buckets(window, region_index["bucket_size"]):
+        region_index["buckets"][bucket].remove(num)
+
+
+# returns the numbers of regions whose windows intersect window
+# (in the order they were added to the index)
+def find_regions(region_index, window):
+    found = set()
+    for bucket in get_buckets(window, region_index["bucket_size"]):
+        for num in region_index["buckets"].get(bucket, ()):
+            if num not in found and intersect_windows(window, region_index["windows"][num]) is not None:
+                found.add(num)
+    return sorted(found, key=region_index["order"].get)
+
@@ -0,0 +1,60 @@
+# region_spans.py
+# The functions in script are called on by "regionalization.py" and "region_state.py"
+# They keep the mask of a region as spans of cells in each row (run-length encoded)
+# Regions are mostly blobs, so a few spans for each row use much less memory than
+# a mask with one value for each cell
+
+import numpy as np
+
+
+##############################################################################
+# functions for spans
+##############################################################################
+
+# spans is a dictionary:
+#   shape   --> (nrows, ncols) of the mask
+#   rows    --> row of each span
+#   starts  --> first column of each span
+#   stops   --> column after the last column of each span
+# spans are in order of row, then column, and spans in the same row never touch
+def create_spans(shape, rows, starts, stops):
+    spans = {
+        "shape"     :   (int(shape[0]), int(shape[1])),
+        "rows"      :   np.asarray(rows, dtype=np.int32),
+        "starts"    :   np.asarray(starts, dtype=np.int32),
+        "stops"     :   np.asarray(stops, dtype=np.int32)
+    }
+    return spans
+
+
+# returns the spans of a mask (2D boolean array)
+def mask_to_spans(mask):
+    # +1 where a span starts, -1 after it stops
+    edges = np.diff(mask.astype(np.int8), axis=1, prepend=0, append=0)
+    rows, starts = np.nonzero(edges == 1)
+    stop_rows, stops = np.nonzero(edges == -1)
+    return create_spans(mask.shape, rows, starts, stops)
+
+
+# returns the part of the mask of spans (placed at window in the map) that is inside
+# part_window, as a boolean array
+# only the spans in part_window are used, so this takes time for the number of spans
+# and the size of part_window (not the size of the whole mask)
+def get_spans_part(spans, window, part_window):
+    first_row = part_window[0].start - window[0].start
+    last_row = part_window[0].stop - window[0].start
+    first_col = part_window[1].start - window[1].start
+    width = part_window[1].stop - part_window[1].start
+
+    rows, starts, stops = spans["rows"], spans["starts"], spans["stops"]
+    inside = ((rows >= first_row) & (rows < last_row) &
+              (stops > first_col) & (starts < first_col + width))
+    rows = rows[inside] - first_row
+    starts = np.clip(starts[inside] - first_col, 0, width)
+    stops = np.clip(stops[inside] - first_col, 0, width)
+
+    # +1 where each span starts and -1 where it stops, then add up along each row
+    edges = np.zeros((last_row - first_row, width + 1), dtype=np.int8)
+    edges[rows, starts] = 1
+    edges[rows, stops] = -1
+    return np.cumsum(edges[:, :width], axis=1, dtype=np.int8) > 0
@@ -0,0 +1,102 @@
+# region_state.py
+# The functions in script are called on by "regionalization.py"
+# They save the finished map, overlaps, and the mask of every region in a folder,
+# so that a later run where only a few regions changed can update the map
+# instead of making it again from the start
+
+import os
+import json
+import hashlib
+import numpy as np
+from region_spans import create_spans
+
+
+##############################################################################
+# functions for saving and loading the state of a map
+##############################################################################
+
+# a window (tuple of row and column slices of the map) is saved as [row start, row stop,
+# col start, col stop]
+def window_to_list(window):
+    return [window[0].start, window[0].stop, window[1].start, window[1].stop]
+
+
+def list_to_window(window_list):
+    return (slice(window_list[0], window_list[1]), slice(window_list[2], window_list[3]))
+
+
+# returns a hash of the spans of a region mask (see region_spans.py) and its window, 
+# used to tell if a region has changed
+def get_mask_hash(window, spans):
+    mask_hash = hashlib.sha1(str(window_to_list(window)).encode("utf-8"))
+    for key in ("rows", "starts", "stops"):
+        mask_hash.update(spans[key].tobytes())
+    return mask_hash.hexdigest()
+
+
+# returns the path of the file with the mask of a region
+def get_region_filename(directory, name):
+    return os.path.join(directory, "region_" + hashlib.sha1(name.encode("utf-8")).hexdigest()[:16] + ".npz")
+
+
+# this function saves the spans of the mask of a region, and its cells with overlaps
+def save_region_state(directory, name, spans, cells):
+    if cells is None:
+        cells = np.zeros(0, dtype=np.int64)
+    with open(get_region_filename(directory, name), 'wb') as file:
+        np.savez(file, rows=spans["rows"], starts=spans["starts"], stops=spans["stops"], cells=cells)
+
+
+# returns the spans of the mask of a region (placed at window in the map)
+def load_region_spans(directory, name, window):
+    shape = (window[0].stop - window[0].start, window[1].stop - window[1].start)
+    with np.load(get_region_filename(directory, name)) as data:
+        return create_spans(shape, data["rows"], data["starts"], data["stops"])
+
+
+# returns the cells (flat index in the map) of a region that were part of an earlier region
+def load_region_cells(directory, name):
+    with np.load(get_region_filename(directory, name)) as data:
+        return data["cells"]
+
+
+# this function removes the saved mask of a region
+def remove_region_state(directory, name):
+    filename = get_region_filename(directory, name)
+    if os.path.exists(filename):
+        os.remove(filename)
+
+
+# this function saves the map, coverage (number of regions in each cell),
+# and information about the map and regions (anything that can be saved as json)
+def save_map_state(directory, state_info, label_map, coverage):
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    np.save(os.path.join(directory, "label_map.npy"), label_map)
+    np.save(os.path.join(directory, "coverage.npy"), coverage)
+    with open(os.path.join(directory, "state.json"), 'w') as file:
+        json.dump(state_info, file)
+
+
+# this function removes the information saved by save_map_state, so that a state that 
+# is only partly saved (e.g. if the program stops while saving) is never used
+def remove_state_info(directory):
+    filename = os.path.join(directory, "state.json")
+    if os.path.exists(filename):
+        os.remove(filename)
+
+
+# returns the information saved by save_map_state, or None if there is no saved state
+def load_state_info(directory):
+    try:
+        with open(os.path.join(directory, "state.json"), 'r') as file:
+            return json.load(file)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+# returns the map and coverage saved by save_map_state
+def load_map_state(directory):
+    label_map = np.load(os.path.join(directory, "label_map.npy"))
+    coverage = np.load(os.path.join(directory, "coverage.npy"))
+    return label_map, coverage
@@ -20,20 +20,50 @@ Output:
     Sheet3 = "overlaps"     --> cells with overlap between regions
 
 
-openpyxl is used to control excel
+openpyxl is used to read and write excel (it is only imported when an excel
+    workbook is read or written)
+numpy is used for the map itself, which is held as an array of region numbers
+    (the smallest integer type that fits all region numbers, e.g. uint8)
 
 """
 ##############################################################################
 import sys
-from openpyxl import Workbook
-from openpyxl.utils import get_column_letter
-from openpyxl.worksheet.dimensions import ColumnDimension, DimensionHolder
-from openpyxl.formatting.rule import ColorScaleRule
+import numpy as np
 import re
+from itertools import islice
 from string import digits
 import csv
+import gzip
 import os
-from user_inputs import *
+import shutil
+import tempfile
+import time
+import zipfile
+import cProfile
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from user_inputs import (define_all_variables, define_all_variables_from_job, read_command_line,
+                         get_job_option, get_workers, load_input_source, get_source_workbook,
+                         close_input_source, read_list_rows, get_source_regions,
+                         check_conflict_value, get_overlap_policies, get_value_rasters, 
+                         get_map_formats, check_map_formats, get_preview_factors, get_levels, 
+                         get_region_parents, default_xlFilename, default_save_csv_names, 
+                         default_save_wb_name, overlaps_formats, overlap_policies)
+from asc_files import (read_asc_header, read_asc_file, iter_asc_rows, to_number, write_asc_header,
+                       write_asc_values)
+from input_cache import (load_cached_header, save_cached_header, load_cached_grid, save_cached_grid,
+                         get_entry_name)
+from region_state import (window_to_list, list_to_window, get_mask_hash, save_region_state, 
+                          load_region_spans, load_region_cells, remove_region_state, 
+                          save_map_state, remove_state_info, load_state_info, load_map_state)
+from region_index import (intersect_windows, create_region_index, add_to_region_index, 
+                          find_regions)
+from region_spans import mask_to_spans, get_spans_part
+from region_checkpoint import (create_checkpoint, add_finished_region, save_checkpoint, 
+                               remove_checkpoints, find_checkpoint, load_checkpoint)
+from run_report import (start_measure, create_run_report, add_stage, add_region, save_run_report)
+from map_preview import downsample_mode, get_preview_image, write_ppm, write_png
+from resampling import is_same_cellsize, get_resampled_header, resample_mask
 
 
 ##############################################################################
@@ -42,15 +72,22 @@ from user_inputs import *
 
 
 
-# returns a dictionary with info from header of each file 
-# (first 2 columns and first 6 rows of a worksheet)
-def get_file_header(ws):
-    ncols = ws['B1'].value
-    nrows = ws['B2'].value
-    xllcorner = ws['B3'].value # bottom left corner
-    yllcorner = ws['B4'].value # bottom left corner (column)
-    cellsize = ws['B5'].value
-    nodata_value = ws['B6'].value
+# returns the values of the first 6 rows of a worksheet (only the first 2 columns)
+# the rows are read in one pass, so this also works for read-only worksheets
+def get_header_rows(ws):
+    return list(ws.iter_rows(min_row=1, max_row=num_extra_top_rows, 
+                             min_col=1, max_col=2, values_only=True))
+
+# returns a dictionary with info from header rows (see get_header_rows)
+def get_header_from_rows(header_rows):
+    # pad rows, in case cells at the end of a row are empty
+    header_rows = [tuple(row) + (None, None) for row in header_rows]
+    ncols = header_rows[0][1]
+    nrows = header_rows[1][1]
+    xllcorner = header_rows[2][1] # bottom left corner
+    yllcorner = header_rows[3][1] # bottom left corner (column)
+    cellsize = header_rows[4][1]
+    nodata_value = header_rows[5][1]
     file_header = {
         "ncols"         :   ncols,
         "nrows"         :   nrows,
@@ -61,6 +98,82 @@ def get_file_header(ws):
     }
     return file_header
 
+# returns a dictionary with info from header of each file 
+# (first 2 columns and first 6 rows of a worksheet)
+def get_file_header(ws):
+    return get_header_from_rows(get_header_rows(ws))
+
+# returns the labels in the first column of the header rows
+def get_header_labels(header_rows):
+    return [row[0] if len(row) > 0 else None for row in header_rows]
+
+# returns the header dictionary, header labels, and values of a worksheet
+# the worksheet is streamed only once from top to bottom
+def read_sheet(ws):
+    rows = ws.iter_rows(values_only=True)
+    header_rows = list(islice(rows, num_extra_top_rows))
+    file_header = get_header_from_rows(header_rows)
+    body_rows = (row[num_extra_left_cols:] for row in rows)
+    values = rows_to_array(body_rows, file_header["nrows"], file_header["ncols"])
+    return file_header, get_header_labels(header_rows), values
+
+# returns the rows of a worksheet (excluding the header) one at a time, as float arrays
+def iter_sheet_rows(ws, file_header):
+    ncols = file_header["ncols"]
+    for row in ws.iter_rows(min_row=num_extra_top_rows + 1, 
+                            max_row=num_extra_top_rows + file_header["nrows"], 
+                            values_only=True):
+        yield rows_to_array([row[num_extra_left_cols:]], 1, ncols)[0]
+
+# returns the path of the .asc file for the sheet name in a folder of .asc files
+def get_asc_filename(source, name):
+    return os.path.join(source["directory"], source["asc_filenames"].get(name, name + ".asc"))
+
+# returns the file that holds a sheet of the input source (the workbook, or the .asc file)
+def get_grid_filename(source, name):
+    if source["directory"] is not None:
+        return get_asc_filename(source, name)
+    return source["name"]
+
+# returns the header dictionary and the header labels of a sheet 
+# (or .asc file) from the input source
+def read_grid_header(source, name):
+    if source["cache"] is not None:
+        cached = load_cached_header(source["cache"], get_grid_filename(source, name), name)
+        if cached is not None:
+            return cached
+    if source["directory"] is not None:
+        file_header, header_labels = read_asc_header(get_asc_filename(source, name))
+    else:
+        header_rows = get_header_rows(get_source_workbook(source)[name])
+        file_header, header_labels = get_header_from_rows(header_rows), get_header_labels(header_rows)
+    if source["cache"] is not None:
+        save_cached_header(source["cache"], get_grid_filename(source, name), name, 
+                           file_header, header_labels)
+    return file_header, header_labels
+
+# returns the header dictionary, header labels, and values of a sheet 
+# (or .asc file) from the input source
+def read_grid(source, name):
+    if source["cache"] is not None:
+        cached = load_cached_grid(source["cache"], get_grid_filename(source, name), name)
+        if cached is not None:
+            return cached
+    if source["directory"] is not None:
+        grid = read_asc_file(get_asc_filename(source, name))
+    else:
+        grid = read_sheet(get_source_workbook(source)[name])
+    if source["cache"] is not None:
+        save_cached_grid(source["cache"], get_grid_filename(source, name), name, *grid)
+    return grid
+
+# returns the rows (excluding the header) of a sheet (or .asc file) 
+# from the input source one at a time, as float arrays
+def iter_grid_rows(source, name, file_header):
+    if source["directory"] is not None:
+        return iter_asc_rows(get_asc_filename(source, name))
+    return iter_sheet_rows(get_source_workbook(source)[name], file_header)
+
 
 # returns a dictionary with basic information about top left and bottom left corners
 def get_area_cell_info(area_header):
@@ -121,105 +234,1418 @@ def get_region_cell_info(region_header, area_header, area_cell_info):
     return region_cell_info
 
 
+# returns the letters of a column number (1 --> A, 27 --> AA), as in excel
+@lru_cache(maxsize=None)
+def get_column_letter(col):
+    letters = ""
+    while col > 0:
+        col, remainder = divmod(col - 1, 26)
+        letters = chr(ord('A') + remainder) + letters
+    return letters
+
 # this function gets the address of a cell when receiving row and col as numbers
 def get_cell_address(col, row):
     col_letter = get_column_letter(col)
     address = col_letter + str(row)
     return address
 
-# this function adds cell with overlap
-def add_overlap(overlaps, row, col):
-    overlaps.append(get_cell_address(col, row))
-    return
+# returns the smallest integer type for the map that fits all region numbers
+# (uint8, uint16 or uint32, where the largest value is kept for cells with no region)
+# int64 is used if any region number is negative or too large
+# (region numbers are whole numbers, see check_region_nums in "user_inputs.py")
+def get_label_dtype(regions):
+    for dtype in label_dtypes:
+        largest_num = np.iinfo(dtype).max - 1
+        if all(float(num).is_integer() and 0 <= num <= largest_num for num in regions):
+            return np.dtype(dtype)
+    return np.dtype(np.int64)
+
+# returns the value in a map of type dtype for cells that are not part of any region
+# (the largest value of unsigned types, and the smallest of int64, which are never region numbers)
+def get_empty_label(dtype):
+    if np.issubdtype(dtype, np.unsignedinteger):
+        return np.iinfo(dtype).max
+    return np.iinfo(dtype).min
+
+# returns the map with its type changed to dtype (cells with no region stay empty)
+def change_label_dtype(label_map, dtype):
+    if label_map.dtype == dtype:
+        return label_map
+    new_label_map = label_map.astype(dtype)
+    new_label_map[label_map == get_empty_label(label_map.dtype)] = get_empty_label(dtype)
+    return new_label_map
+
+# returns an empty map (every cell is the empty label) with the same shape as the area
+# dtype should fit every region number (see get_label_dtype)
+# if directory is given, the map is kept in a file in the directory (memory-mapped)
+def create_label_map(area_header, directory=None, dtype=np.int64):
+    shape = (area_header["nrows"], area_header["ncols"])
+    if directory is None:
+        return np.full(shape, get_empty_label(dtype), dtype=dtype)
+    label_map = np.lib.format.open_memmap(os.path.join(directory, "label_map.npy"), 
+                                          mode='w+', dtype=dtype, shape=shape)
+    label_map.fill(get_empty_label(dtype))
+    return label_map
+
+# returns the rows below and right of the header as a 2D float array
+# blanks (None or "") and text are returned as nan
+def rows_to_array(rows, nrows, ncols):
+    values = np.full((nrows, ncols), np.nan)
+    for row_num, row in enumerate(rows):
+        if row_num >= nrows:
+            break
+        row = row[:ncols]
+        try:
+            values[row_num, :len(row)] = row
+        except (ValueError, TypeError):
+            # only rows with strings in them get converted cell by cell
+            values[row_num, :len(row)] = [val if isinstance(val, (int, float)) else np.nan
+                                            for val in row]
+    return values
+
+# returns a boolean array, True for every cell that is not blank or the nodata value
+def get_region_mask(region_values, nodata_value):
+    mask = ~np.isnan(region_values)
+    if nodata_value is not None:
+        mask &= (region_values != nodata_value)
+    return mask
+
+# returns the slices of the map and of the region that line up with each other
+# the region is clipped so that only the part inside the area is used
+def get_region_window(label_map, region_header, region_cell_info):
+    return get_region_window_in_shape(label_map.shape, region_header, region_cell_info)
+
+# returns the slices of a map with the given shape (nrows, ncols) and of the region
+# that line up with each other (see get_region_window)
+def get_region_window_in_shape(shape, region_header, region_cell_info):
+    # top left of region as index in label_map (header rows and columns not included)
+    map_row = region_cell_info["top_left_row"] - num_extra_top_rows - 1
+    map_col = region_cell_info["top_left_col"] - num_extra_left_cols - 1
+
+    row_start = max(map_row, 0)
+    col_start = max(map_col, 0)
+    row_end = min(map_row + region_header["nrows"], shape[0])
+    col_end = min(map_col + region_header["ncols"], shape[1])
+    if row_end <= row_start or col_end <= col_start:
+        return None
+
+    map_window = (slice(row_start, row_end), slice(col_start, col_end))
+    region_window = (slice(row_start - map_row, row_end - map_row),
+                     slice(col_start - map_col, col_end - map_col))
+    return map_window, region_window
 
-# this function sets values in map_ws to the value of change_to_num, according to region_ws
-# does not include blanks or nodatavalues 
-def set_cells_to_num_except_blanks(map_ws, region_ws, region_header, region_cell_info, change_to_num, overlaps):
-    ncols = region_header["ncols"]
-    nrows = region_header["nrows"]
-    nodata_value = region_header["nodata_value"]
-    region_top_left_row = region_cell_info["top_left_row"]
-    region_top_left_col = region_cell_info["top_left_col"]
-    
-    for row in range(nrows):
-            for col in range(ncols):
-                cell_val = region_ws.cell(row=row + num_extra_top_rows + 1, 
-                                            column=col + num_extra_left_cols + 1).value
-                
-                # check to see if there will be overlap
-                map_ws_current_row = region_top_left_row + row
-                map_ws_current_col = region_top_left_col + col
-                map_ws_current_val = map_ws.cell(row=map_ws_current_row, 
-                                    column=map_ws_current_col).value
-
-                if cell_val not in (nodata_value, None, ""):
-                    # check to see if there will be overlap
-                    if map_ws_current_val not in (None, ""):
-                        add_overlap(overlaps, map_ws_current_row, map_ws_current_col)
-
-                    # change value on map_ws
-                    map_ws.cell(row=map_ws_current_row, 
-                                    column=map_ws_current_col).value = change_to_num
+##############################################################################
+# functions for regions with a different cellsize than the area
+##############################################################################
 
-# this function takes in information from each region
-# and adds that information to map_ws
-def each_region(wb, regions, map_ws, area_header, area_cell_info, overlaps, xlFilename):
+# returns True if a region has to be resampled to the cells of the area before it is 
+# added to the map (resample is "off", or one of resample_methods in resampling.py)
+def needs_resampling(region_header, area_header, resample):
+    return resample != "off" and not is_same_cellsize(region_header, area_header)
+
+# returns the header dictionary and header labels of a region (see read_grid_header)
+# if the region is resampled (see needs_resampling), the header is of the resampled region
+def read_region_header(source, name, area_header, resample="off"):
+    region_header, region_header_labels = read_grid_header(source, name)
+    if needs_resampling(region_header, area_header, resample):
+        region_header = get_resampled_header(region_header, area_header)
+    return region_header, region_header_labels
+
+# returns the header dictionary, header labels, and values of a region (see read_grid)
+# if the region is resampled (see needs_resampling), its mask is resampled to the cells 
+# of the area, and the values are 1 in the region and nan everywhere else
+def read_region_grid(source, name, area_header, resample="off"):
+    region_header, region_header_labels, region_values = read_grid(source, name)
+    if needs_resampling(region_header, area_header, resample):
+        mask = get_region_mask(region_values, region_header["nodata_value"])
+        mask, region_header = resample_mask(mask, region_header, area_header, resample)
+        region_values = np.where(mask, 1.0, np.nan)
+    return region_header, region_header_labels, region_values
+
+##############################################################################
+# functions for checking the inputs before making the map
+##############################################################################
+
+# returns the problems with the values of a header (see get_file_header), as messages
+def get_header_problems(file_header):
+    problems = []
+    for key in file_header:
+        value = file_header[key]
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            problems.append("'" + key + "' is not a number (" + repr(value) + ")")
+    if problems:
+        return problems
+    for key in ("ncols", "nrows"):
+        if not float(file_header[key]).is_integer() or file_header[key] <= 0:
+            problems.append("'" + key + "' is not a whole number above 0 (" + 
+                            str(file_header[key]) + ")")
+    if file_header["cellsize"] <= 0:
+        problems.append("'cellsize' is not above 0 (" + str(file_header["cellsize"]) + ")")
+    return problems
+
+# returns the header and header labels of a sheet (see read_grid_header), 
+# or the problems that stop it from being used, as messages
+def check_grid_header(source, name):
+    if name not in source["sheetnames"]:
+        return None, ["a worksheet (or .asc file) with this name does not exist in '" + 
+                      source["name"] + "'"]
+    try:
+        file_header, header_labels = read_grid_header(source, name)
+    except (ValueError, TypeError, IndexError, KeyError, OSError) as error:
+        return None, ["the header cannot be read (" + str(error) + ")"]
+    return file_header, get_header_problems(file_header)
+
+# returns the problems with the area and regions that can be found from their headers
+# (only the 6 header rows of each sheet, or .asc file, are read)
+# each problem is a dictionary with:
+#   severity    --> "ERROR" if the map would be wrong or cannot be made, otherwise "WARNING"
+#   name        --> name of the area or region
+#   message     --> what the problem is
+# regions with a different cellsize are an error, unless they are resampled (resample 
+# is not "off"), and are then checked as they will be once resampled
+# value_rasters (see get_zonal_stats) have to be on the same cells as the area
+def check_inputs(source, area_name, regions, resample="off", value_rasters=()):
+    problems = []
+    def add_problem(severity, name, message):
+        problems.append({"severity": severity, "name": name, "message": message})
+
+    area_header, messages = check_grid_header(source, area_name)
+    for message in messages:
+        add_problem("ERROR", area_name, message)
+    if messages:
+        return problems
+    area_cell_info = get_area_cell_info(area_header)
+    area_shape = (area_header["nrows"], area_header["ncols"])
+    cellsize = area_header["cellsize"]
+
+    for num in regions:
+        name = regions[num]
+        region_header, messages = check_grid_header(source, name)
+        for message in messages:
+            add_problem("ERROR", name, message)
+        if messages:
+            continue
+
+        resampled = needs_resampling(region_header, area_header, resample)
+        if resampled:
+            add_problem("WARNING", name, "cellsize " + str(region_header["cellsize"]) + 
+                        " is not the same as the area (" + str(cellsize) + "), so the region " + 
+                        "is resampled to the cells of the area (" + resample + ")")
+        elif region_header["cellsize"] != cellsize:
+            add_problem("ERROR", name, "cellsize " + str(region_header["cellsize"]) + 
+                        " is not the same as the area (" + str(cellsize) + 
+                        "), set 'resample' to resample it")
+            continue
+        else:
+            for key in ("xllcorner", "yllcorner"):
+                offset = (region_header[key] - area_header[key]) / cellsize
+                if abs(offset - round(offset)) > cell_alignment_tolerance:
+                    add_problem("WARNING", name, key + " is not on the edge of a cell of the " + 
+                                "area (the region is moved to the nearest cell)")
+        if region_header["nodata_value"] != area_header["nodata_value"]:
+            add_problem("WARNING", name, "nodata_value " + str(region_header["nodata_value"]) + 
+                        " is not the same as the area (" + str(area_header["nodata_value"]) + ")")
+        if resampled:
+            region_header = get_resampled_header(region_header, area_header)
+
+        region_cell_info = get_region_cell_info(region_header, area_header, area_cell_info)
+        window = get_region_window_in_shape(area_shape, region_header, region_cell_info)
+        if window is None:
+            add_problem("WARNING", name, "the region is completely outside of the area")
+        else:
+            map_window, region_window = window
+            num_inside = ((map_window[0].stop - map_window[0].start) * 
+                          (map_window[1].stop - map_window[1].start))
+            num_outside = region_header["nrows"] * region_header["ncols"] - num_inside
+            if num_outside > 0:
+                add_problem("WARNING", name, str(num_outside) + " cells (including blanks) " + 
+                            "are outside of the area")
+
+    for name in value_rasters:
+        file_header, messages = check_grid_header(source, name)
+        if not messages:
+            differences = get_grid_differences(file_header, area_header)
+            if differences:
+                messages = ["the value raster is not on the same cells as the area (" + 
+                            ", ".join(differences) + " not the same)"]
+        for message in messages:
+            add_problem("ERROR", name, message)
+    return problems
+
+# this function prints all problems found by check_inputs together
+def print_input_problems(problems, num_regions):
+    num_errors = sum(problem["severity"] == "ERROR" for problem in problems)
+    print("Checked the headers of the area and " + str(num_regions) + " regions: " + 
+          str(num_errors) + " errors, " + str(len(problems) - num_errors) + " warnings")
+    for problem in problems:
+        print(problem["severity"] + ": '" + str(problem["name"]) + "': " + problem["message"])
+
+# returns the message of a ValueError for the errors found by check_inputs
+def get_input_errors_message(problems):
+    errors = [problem for problem in problems if problem["severity"] == "ERROR"]
+    return (str(len(errors)) + " problems were found in the inputs:\n" + 
+            "\n".join("'" + str(error["name"]) + "': " + error["message"] for error in errors))
+
+
+##############################################################################
+# functions for overlaps
+##############################################################################
+
+# returns a dictionary to keep track of overlaps between regions:
+#   coverage    --> number of regions that cover each cell of the map
+#   pairs       --> matrix with number of cells where each pair of regions overlap
+#                   (rows and columns in the same order as regions)
+#   index       --> row/column in pairs for each region number
+#   cells       --> list of (region number, cells), where cells are the flat index 
+#                   in the map of cells that were already part of an earlier region
+#   masks       --> region number --> (window in the map, spans of the mask) of each region 
+#                   added so far (see region_spans.py)
+#   region_index--> spatial index of the windows of all regions (see region_index.py), 
+#                   or None to compare each region with all earlier regions
+# if directory is given, coverage is kept in a file in the directory (memory-mapped)
+def create_overlaps(label_map, regions, directory=None):
+    num_regions = len(regions)
+    if directory is None:
+        coverage = np.zeros(label_map.shape, dtype=np.uint16)
+    else:
+        coverage = np.lib.format.open_memmap(os.path.join(directory, "coverage.npy"), 
+                                             mode='w+', dtype=np.uint16, shape=label_map.shape)
+    overlaps = {
+        "coverage"  :   coverage,
+        "pairs"     :   np.zeros((num_regions, num_regions), dtype=np.int64),
+        "index"     :   {num: index for index, num in enumerate(regions)},
+        "cells"     :   [],
+        "masks"     :   {},
+        "region_index": None
+    }
+    return overlaps
+
+# returns the part of mask (placed at window in the map) that is inside part_window
+def get_mask_part(mask, window, part_window):
+    return mask[part_window[0].start - window[0].start : part_window[0].stop - window[0].start,
+                part_window[1].start - window[1].start : part_window[1].stop - window[1].start]
+
+# returns the (number, window, spans) of the regions added before that may overlap map_window
+# if there is a region index, only regions with windows that intersect map_window are checked
+def get_earlier_masks(overlaps, map_window):
+    if overlaps["region_index"] is None:
+        nums = list(overlaps["masks"])
+    else:
+        nums = [num for num in find_regions(overlaps["region_index"], map_window) 
+                if num in overlaps["masks"]]
+    earlier_masks = []
+    for num in nums:
+        window, spans = overlaps["masks"][num]
+        if intersect_windows(map_window, window) is not None:
+            earlier_masks.append((num, window, spans))
+    return earlier_masks
+
+# this function adds the overlaps of a region (mask placed at map_window) 
+# with all regions added to the map before it
+# cells are only compared where the windows of two regions intersect
+# the mask is kept as spans (see region_spans.py) to compare with later regions
+def add_overlaps(overlaps, label_map, map_window, mask, num):
+    index = overlaps["index"][num]
+    overlap_cells = None
+    for other_num, other_window, other_spans in get_earlier_masks(overlaps, map_window):
+        part_window = intersect_windows(map_window, other_window)
+        both = (get_mask_part(mask, map_window, part_window) & 
+                get_spans_part(other_spans, other_window, part_window))
+        num_cells = int(np.count_nonzero(both))
+        if num_cells == 0:
+            continue
+
+        # number of overlapping cells with each earlier region
+        other_index = overlaps["index"][other_num]
+        overlaps["pairs"][index, other_index] += num_cells
+        overlaps["pairs"][other_index, index] += num_cells
+
+        # cells that were already part of another region
+        if overlap_cells is None:
+            overlap_cells = np.zeros(mask.shape, dtype=bool)
+        get_mask_part(overlap_cells, map_window, part_window)[...] |= both
+
+    if overlap_cells is not None:
+        overlap_rows, overlap_cols = np.nonzero(overlap_cells)
+        overlaps["cells"].append((num, np.ravel_multi_index((overlap_rows + map_window[0].start, 
+                                                             overlap_cols + map_window[1].start),
+                                                            label_map.shape)))
+    overlaps["coverage"][map_window] += mask
+    overlaps["masks"][num] = (map_window, mask_to_spans(mask))
+
+# returns the number of cells in the list of cells with overlaps
+# (only those found after the first start items of the list, if start is given)
+def count_overlaps(overlaps, start=0):
+    return sum(int(cells.size) for num, cells in overlaps["cells"][start:])
+
+# returns the address of each cell with overlaps (as they were found)
+def get_overlap_addresses(overlaps):
+    ncols = overlaps["coverage"].shape[1]
+    for num, cells in overlaps["cells"]:
+        rows, cols = np.divmod(cells, ncols)
+        for row, col in zip(rows.tolist(), cols.tolist()):
+            yield get_cell_address(col + num_extra_left_cols + 1, row + num_extra_top_rows + 1)
+
+# returns the runs of cells in each row that have the same number (2 or more) of regions
+# as (first cell address, last cell address, number of regions)
+def get_overlap_runs(overlaps):
+    coverage = overlaps["coverage"]
+    for row in range(coverage.shape[0]):
+        values = coverage[row]
+        if values.max() < 2:
+            continue
+        # runs start where the value changes
+        starts = np.concatenate(([0], np.nonzero(values[1:] != values[:-1])[0] + 1))
+        ends = np.concatenate((starts[1:], [values.size]))
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            if values[start] > 1:
+                sheet_row = row + num_extra_top_rows + 1
+                yield (get_cell_address(start + num_extra_left_cols + 1, sheet_row),
+                       get_cell_address(end + num_extra_left_cols, sheet_row),
+                       int(values[start]))
+
+# returns (region number, region number, number of cells) 
+# for each pair of regions that overlap
+def get_overlap_pairs(overlaps):
+    nums = list(overlaps["index"])
+    pairs = overlaps["pairs"]
+    for index_a, index_b in zip(*np.nonzero(np.triu(pairs, k=1))):
+        yield nums[index_a], nums[index_b], int(pairs[index_a, index_b])
+
+
+# this function sets values in label_map to the value of change_to_num, where mask is True
+# mask has the shape of the region, and is placed using region_cell_info
+# returns the number of cells of the region that are outside of the area
+def set_mask_to_num(label_map, mask, region_header, region_cell_info, change_to_num, overlaps):
+    num_cells = int(np.count_nonzero(mask))
+
+    window = get_region_window(label_map, region_header, region_cell_info)
+    if window is None:
+        return num_cells
+    map_window, region_window = window
+    mask = mask[region_window]
+    add_mask_to_map(label_map, map_window, mask, change_to_num, overlaps)
+
+    return num_cells - int(np.count_nonzero(mask))
+
+# this function sets values in label_map inside map_window to change_to_num, where mask is True
+# mask has the same shape as map_window
+def add_mask_to_map(label_map, map_window, mask, change_to_num, overlaps):
+    # check to see if there will be overlap
+    add_overlaps(overlaps, label_map, map_window, mask, change_to_num)
+
+    # change value on label_map
+    map_values = label_map[map_window]
+    map_values[mask] = change_to_num
+
+# this function sets values in label_map to the value of change_to_num, according to region_values
+# does not include blanks or nodatavalues
+# returns the number of cells of the region that are outside of the area
+def set_cells_to_num_except_blanks(label_map, region_values, region_header, region_cell_info, change_to_num, overlaps):
+    mask = get_region_mask(region_values, region_header["nodata_value"])
+    return set_mask_to_num(label_map, mask, region_header, region_cell_info, change_to_num, overlaps)
+
+# this function prints that a region was added to the map
+def print_region_finished(region, num_outside):
+    if num_outside > 0:
+        print("WARNING: " + str(num_outside) + " cells of region '" + region + 
+              "' are outside of the area and were not added")
+    print("Now finished region: " + region)
+
+# returns the regions that exist in the input source
+# prints an error for any region that does not
+def get_existing_regions(source, regions):
+    existing_regions = {}
     for num in regions:
         region = regions[num]
 
-        # if given region does not exist in workbook
-        if not region in wb.sheetnames:
+        # if given region does not exist in workbook (or folder)
+        if not region in source["sheetnames"]:
             print("ERROR: A worksheet with region name '" + 
-                region + "' does not exist in workbook '" + xlFilename +"'")
+                region + "' does not exist in '" + source["name"] +"'")
             continue
-        
-        region_ws = wb[region]
-        region_header = get_file_header(region_ws)
+        existing_regions[num] = region
+    return existing_regions
+
+# returns (region header, window in the map) of each region, using only the region headers
+# regions that are completely outside of the area are not returned (and are never read)
+# the windows are also added to a spatial index in overlaps (see region_index.py)
+def get_region_windows(source, regions, label_map, area_header, area_cell_info, overlaps,
+                       resample="off"):
+    region_windows = {}
+    overlaps["region_index"] = create_region_index(label_map.shape, len(regions))
+    for num in regions:
+        region_header, region_header_labels = read_region_header(source, regions[num], 
+                                                                 area_header, resample)
         region_cell_info = get_region_cell_info(region_header, area_header, area_cell_info)
-        
-        set_cells_to_num_except_blanks(map_ws, region_ws, region_header, region_cell_info, num, overlaps)
+        window = get_region_window(label_map, region_header, region_cell_info)
+        if window is None:
+            print("WARNING: region '" + regions[num] + 
+                  "' is completely outside of the area and was not added")
+            continue
+        region_windows[num] = (region_header, window)
+        add_to_region_index(overlaps["region_index"], num, window[0])
+    return region_windows
+
+# this function takes in information from each region
+# and adds that information to label_map
+# if workers is more than 1, regions are read in parallel (see each_region_parallel)
+# the time, cells and overlaps of each region are added to run_report (see run_report.py)
+# regions with a different cellsize are resampled unless resample is "off" (see resampling.py)
+# checkpoints are saved while regions are added (see region_checkpoint.py), and regions
+# already finished in checkpoint (when resuming from a checkpoint) are not added again
+def each_region(source, regions, label_map, area_header, area_cell_info, overlaps, workers=1,
+                run_report=None, resample="off", checkpoint=None):
+    regions = get_existing_regions(source, regions)
+    region_windows = get_region_windows(source, regions, label_map, area_header, area_cell_info, 
+                                        overlaps, resample)
+    regions = {num: regions[num] for num in region_windows}
+    if checkpoint is not None:
+        finished = set(checkpoint["finished"])
+        regions = {num: regions[num] for num in regions if num not in finished}
+    if workers > 1 and len(regions) > 1:
+        each_region_parallel(source, regions, label_map, area_header, area_cell_info, overlaps, workers,
+                             run_report, resample, checkpoint)
+        return
 
-        print("Now finished region: " + regions[num])
+    for num in regions:
+        region = regions[num]
+        start = start_measure()
+        num_overlap_lists = len(overlaps["cells"])
+        region_header, region_header_labels, region_values = read_region_grid(source, region, 
+                                                                              area_header, resample)
+        region_cell_info = get_region_cell_info(region_header, area_header, area_cell_info)
+        
+        num_outside = set_cells_to_num_except_blanks(label_map, region_values, region_header, 
+                                                     region_cell_info, num, overlaps)
+        add_region(run_report, region, start, region_values.size, 
+                   count_overlaps(overlaps, num_overlap_lists))
+        print_region_finished(region, num_outside)
+        add_finished_region(checkpoint, num, label_map, overlaps)
     
     return
 
 
-# this function sets range of 'A1':'B6' to be equal 
-# between sheets map_ws & area_ws
-def set_headers_equal(map_ws, area_ws):
-    # set header in map as the same as header in area
-    cellsToCopy = []
-    for letter in ['A','B']:
-        for num in range(1,7):
-            cellsToCopy.append(letter + str(num))
+##############################################################################
+# functions for checkpoints (to resume a run that stopped part way)
+##############################################################################
+
+# returns what a checkpoint of the map is made from (see create_checkpoint), 
+# so that a checkpoint is only resumed with the same input, area and regions
+def get_checkpoint_run_info(source, area_name, area_header, regions, resample="off"):
+    run_info = {
+        "input"         :   os.path.abspath(source["name"]),
+        "area_name"     :   area_name,
+        "area_header"   :   area_header,
+        "regions"       :   [[num, regions[num]] for num in regions],
+        "file_keys"     :   {regions[num]: get_region_file_key(source, regions[num]) 
+                             for num in regions if regions[num] in source["sheetnames"]},
+        "resample"      :   resample
+    }
+    return run_info
+
+# returns the checkpoint to keep while regions are added (see create_checkpoint), 
+# and label_map
+# if resume, label_map and overlaps are set to the last checkpoint in directory with the 
+# same run_info (if there is one), otherwise any old checkpoints are removed first
+def start_checkpoints(directory, seconds, run_info, label_map, overlaps, resume=False):
+    if resume:
+        checkpoint_info, slot_directory = find_checkpoint(directory, run_info)
+        if checkpoint_info is not None:
+            try:
+                label_map = load_checkpoint(checkpoint_info, slot_directory, overlaps)
+                print("Resuming from the checkpoint in '" + slot_directory + "' (" + 
+                      str(len(checkpoint_info["finished"])) + " regions were finished)")
+                return create_checkpoint(directory, seconds, run_info, 
+                                         checkpoint_info["finished"]), label_map
+            except (ValueError, OSError, KeyError) as error:
+                print("WARNING: " + str(error) + ", so the map is made from the start")
+                # overlaps may have been partly set from the checkpoint (index has all regions)
+                overlaps.update(create_overlaps(label_map, overlaps["index"]))
+        else:
+            print("No checkpoint for this input and area was found in '" + directory + 
+                  "', so the map is made from the start")
+    remove_checkpoints(directory)
+    return create_checkpoint(directory, seconds, run_info), label_map
 
-    for val in cellsToCopy:
-        map_ws[val].value = area_ws[val].value
 
-# this function sets blanks in map_ws that are within borders to the no data value
+##############################################################################
+# functions for reading regions in parallel
+##############################################################################
+
+# input source opened by each worker process (see init_region_worker)
+worker_source = None
+
+# this function opens the input source once in each worker process
+def init_region_worker(xlFilename, input_cache):
+    global worker_source
+    worker_source = load_input_source(xlFilename, quiet=True, input_cache=input_cache)
+
+# this function is run by the worker processes
+# it reads one region and returns its header, cell info, packed mask 
+# and the seconds it took
+def read_region_mask(region, area_header, area_cell_info, resample="off"):
+    start_time = time.perf_counter()
+    region_header, region_header_labels, region_values = read_region_grid(worker_source, region, 
+                                                                          area_header, resample)
+    region_cell_info = get_region_cell_info(region_header, area_header, area_cell_info)
+    mask = get_region_mask(region_values, region_header["nodata_value"])
+    return (region_header, region_cell_info, np.packbits(mask, axis=None), 
+            time.perf_counter() - start_time)
+
+# returns the mask packed by read_region_mask
+def unpack_region_mask(packed_mask, region_header):
+    shape = (region_header["nrows"], region_header["ncols"])
+    return np.unpackbits(packed_mask, count=shape[0] * shape[1]).reshape(shape).astype(bool)
+
+# this function reads the regions in a pool of worker processes
+# and adds them to label_map in the same order as each_region does,
+# so that overlaps (and which region is kept in overlapping cells) are the same
+def each_region_parallel(source, regions, label_map, area_header, area_cell_info, overlaps, workers,
+                         run_report=None, resample="off", checkpoint=None):
+    print("Reading regions with " + str(workers) + " worker processes")
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_region_worker, 
+                             initargs=(source["name"], source["cache"])) as executor:
+        futures = {}
+        for num in regions:
+            futures[num] = executor.submit(read_region_mask, regions[num], area_header, 
+                                           area_cell_info, resample)
+
+        for num in regions:
+            region_header, region_cell_info, packed_mask, read_seconds = futures.pop(num).result()
+            # time of each region is the time to read it (in a worker) and to add it to the map
+            start = start_measure()
+            num_overlap_lists = len(overlaps["cells"])
+            mask = unpack_region_mask(packed_mask, region_header)
+            num_outside = set_mask_to_num(label_map, mask, region_header, 
+                                          region_cell_info, num, overlaps)
+            add_region(run_report, regions[num], start, mask.size, 
+                       count_overlaps(overlaps, num_overlap_lists), read_seconds)
+            print_region_finished(regions[num], num_outside)
+            add_finished_region(checkpoint, num, label_map, overlaps)
+
+    return
+
+
+##############################################################################
+# functions for tiled processing (for maps larger than memory)
+##############################################################################
+
+# this function adds each region to label_map one band of tile_rows rows at a time
+# only the rows of regions that are inside the current band are read, and regions are
+# streamed from top to bottom, so only one band of each region is in memory at a time
+# label_map (and coverage in overlaps) should be memory-mapped (see create_label_map)
+# the time of each region is added up over all bands
+def each_region_tiled(source, regions, label_map, area_header, area_cell_info, overlaps, tile_rows,
+                      run_report=None):
+    regions = get_existing_regions(source, regions)
+    print("Making the map in bands of " + str(tile_rows) + " rows")
+
+    # only the headers are read first, to find where each region is in the map
+    region_windows = get_region_windows(source, regions, label_map, area_header, area_cell_info, overlaps)
+    for num in region_windows:
+        region_header, (map_window, region_window) = region_windows[num]
+        if (region_window[0].stop - region_window[0].start < region_header["nrows"] or
+                region_window[1].stop - region_window[1].start < region_header["ncols"]):
+            print("WARNING: region '" + regions[num] + "' is partly outside " + 
+                  "of the area, cells outside were not added")
+
+    readers = {}
+    region_seconds = {}
+    region_overlaps = {}
+    nrows = label_map.shape[0]
+    for band_start in range(0, nrows, tile_rows):
+        band_window = (slice(band_start, min(band_start + tile_rows, nrows)), slice(0, label_map.shape[1]))
+        # pairs of overlapping regions are found within each band
+        overlaps["masks"] = {}
+
+        for num in region_windows:
+            region_header, (map_window, region_window) = region_windows[num]
+            part_window = intersect_windows(map_window, band_window)
+            if part_window is None:
+                continue
+
+            start_time = time.perf_counter()
+            num_overlap_lists = len(overlaps["cells"])
+            if num not in readers:
+                readers[num] = iter_grid_rows(source, regions[num], region_header)
+                # skip rows of the region above the area
+                for row in range(region_window[0].start):
+                    next(readers[num])
+
+            rows = []
+            for row in range(part_window[0].stop - part_window[0].start):
+                try:
+                    rows.append(next(readers[num]))
+                except StopIteration:
+                    raise ValueError("Region '" + regions[num] + "' has fewer rows than its header says")
+            region_values = np.array(rows)[:, region_window[1]]
+            mask = get_region_mask(region_values, region_header["nodata_value"])
+            add_mask_to_map(label_map, part_window, mask, num, overlaps)
+            region_seconds[num] = region_seconds.get(num, 0) + time.perf_counter() - start_time
+            region_overlaps[num] = (region_overlaps.get(num, 0) + 
+                                    count_overlaps(overlaps, num_overlap_lists))
+
+            if part_window[0].stop == map_window[0].stop:
+                readers.pop(num).close()
+                # the region was read in parts between other regions, so its change in 
+                # memory is not known (no memory at the start, see end_measure)
+                add_region(run_report, regions[num], (time.perf_counter(), None), 
+                           region_header["ncols"] * region_header["nrows"], 
+                           region_overlaps[num], region_seconds[num])
+                print_region_finished(regions[num], 0)
+
+        label_map.flush()
+
+    # keep the cells with overlaps in the same order as each_region
+    overlaps["cells"].sort(key=lambda item: overlaps["index"][item[0]])
+    overlaps["masks"] = {}
+    return
+
+
+##############################################################################
+# functions for updating a saved map when only some regions change
+##############################################################################
+
+# returns a key for the file that holds a region, which changes when the file changes
+def get_region_file_key(source, name):
+    return get_entry_name(get_grid_filename(source, name), name)
+
+# this function saves the map, overlaps and region masks into state_directory
+# (see region_state.py), so that the next run can update it with update_from_state
+# only the masks of regions in save_names are saved (all regions if None)
+# resample is saved too, since the masks of resampled regions depend on it
+def save_state(state_directory, source, area_name, area_header, regions, label_map, overlaps,
+               save_names=None, old_state_info=None, resample="off"):
+    if not os.path.exists(state_directory):
+        os.makedirs(state_directory)
+    remove_state_info(state_directory)
+
+    state_info = {
+        "input"         :   os.path.abspath(source["name"]),
+        "mask_format"   :   "spans",
+        "area_name"     :   area_name,
+        "area_header"   :   area_header,
+        "resample"      :   resample,
+        "regions"       :   [[num, regions[num]] for num in regions],
+        "numbers"       :   {},
+        "file_keys"     :   {},
+        "windows"       :   {},
+        "mask_hashes"   :   {},
+        "pairs"         :   [[regions[num_a], regions[num_b], count] 
+                             for num_a, num_b, count in get_overlap_pairs(overlaps)]
+    }
+    if old_state_info is not None:
+        for key in ("numbers", "file_keys", "windows", "mask_hashes"):
+            state_info[key] = {name: old_state_info[key][name] for name in old_state_info[key]
+                               if name in regions.values()}
+
+    cells = {}
+    for num, region_cells in overlaps["cells"]:
+        cells.setdefault(num, []).append(region_cells)
+
+    for num in overlaps["masks"]:
+        name = regions[num]
+        if save_names is not None and name not in save_names:
+            continue
+        window, spans = overlaps["masks"][num]
+        region_cells = np.concatenate(cells[num]) if num in cells else None
+        save_region_state(state_directory, name, spans, region_cells)
+        state_info["numbers"][name] = num
+        state_info["file_keys"][name] = get_region_file_key(source, name)
+        state_info["windows"][name] = window_to_list(window)
+        state_info["mask_hashes"][name] = get_mask_hash(window, spans)
+
+    # names of regions that no longer have a mask
+    for name in list(state_info["numbers"]):
+        if name not in [regions[num] for num in overlaps["masks"]]:
+            for key in ("numbers", "file_keys", "windows", "mask_hashes"):
+                state_info[key].pop(name, None)
+            remove_region_state(state_directory, name)
+
+    save_map_state(state_directory, state_info, label_map, overlaps["coverage"])
+
+# returns the label_map and overlaps from the map saved in state_directory, updated 
+# for regions that were added, removed or changed since it was saved
+# only cells inside the windows of changed regions are made again, 
+# and overlaps are only found again for regions whose windows intersect them
+# returns None if the map has to be made from the start instead
+def update_from_state(state_directory, source, area_name, area_header, area_cell_info, regions,
+                      resample="off"):
+    state_info = load_state_info(state_directory)
+    if state_info is None or state_info.get("mask_format") != "spans":
+        return None
+    if (state_info["input"] != os.path.abspath(source["name"]) or 
+            state_info["area_name"] != area_name or state_info["area_header"] != area_header):
+        print("The saved map in '" + state_directory + "' is for a different input or area, " + 
+              "so the map is made from the start")
+        return None
+    if state_info.get("resample", "off") != resample:
+        print("The saved map in '" + state_directory + "' was made with a different 'resample', " + 
+              "so the map is made from the start")
+        return None
+
+    existing_regions = get_existing_regions(source, regions)
+    names = {existing_regions[num]: num for num in existing_regions}
+    old_numbers = state_info["numbers"]
+
+    # regions kept from the saved map must still be in the same order
+    old_order = [name for num, name in state_info["regions"] 
+                 if name in old_numbers and names.get(name) == old_numbers[name]]
+    new_order = [name for name in names if name in old_numbers and names[name] == old_numbers[name]]
+    if old_order != new_order:
+        print("The order of regions changed since the map in '" + state_directory + 
+              "' was saved, so the map is made from the start")
+        return None
+
+    label_map, coverage = load_map_state(state_directory)
+    # region numbers may no longer fit the type of the saved map
+    label_map = change_label_dtype(label_map, get_label_dtype(regions))
+    windows = {name: list_to_window(state_info["windows"][name]) for name in new_order}
+    removed = set(old_numbers) - set(new_order)
+    changed = set(removed)
+
+    # regions that are new, or whose file changed, are read again
+    new_masks = {}
+    for name in names:
+        file_key = get_region_file_key(source, name)
+        if name in windows and file_key == state_info["file_keys"][name]:
+            continue
+        region_header, region_header_labels, region_values = read_region_grid(source, name, 
+                                                                              area_header, resample)
+        region_cell_info = get_region_cell_info(region_header, area_header, area_cell_info)
+        mask = get_region_mask(region_values, region_header["nodata_value"])
+        num_cells = int(np.count_nonzero(mask))
+        window = get_region_window(label_map, region_header, region_cell_info)
+        if window is None:
+            print("WARNING: region '" + name + "' is completely outside of the area and was not added")
+            if name in windows:
+                changed.add(name)
+                removed.add(name)
+                del windows[name]
+            continue
+        map_window, region_window = window
+        mask = mask[region_window]
+        spans = mask_to_spans(mask)
+        if (name in windows and 
+                get_mask_hash(map_window, spans) == state_info["mask_hashes"][name]):
+            # the region did not change, but its file did (e.g. another sheet of the workbook),
+            # so the new key is saved to not read it again next time
+            state_info["file_keys"][name] = file_key
+            continue
+        if name in windows:
+            # the old window has to be made again too
+            removed.add(name)
+        changed.add(name)
+        new_masks[name] = (map_window, spans)
+        print_region_finished(name, num_cells - int(np.count_nonzero(mask)))
+
+    if not changed:
+        print("No regions changed since the map in '" + state_directory + "' was saved")
+
+    # windows of the map that have to be made again (old and new windows of changed regions)
+    dirty_windows = [list_to_window(state_info["windows"][name]) for name in removed]
+    dirty_windows += [new_masks[name][0] for name in new_masks]
+    for name in new_masks:
+        windows[name] = new_masks[name][0]
+
+    # regions in map order, with the spatial index of their windows
+    order = [names[name] for name in names if name in windows]
+    region_index = create_region_index(label_map.shape, len(order))
+    for num in order:
+        add_to_region_index(region_index, num, windows[existing_regions[num]])
+
+    # spans of the mask of each region (see region_spans.py), only loaded when needed
+    masks = {}
+    def get_spans(num):
+        name = existing_regions[num]
+        if num not in masks:
+            if name in new_masks:
+                masks[num] = new_masks[name][1]
+            else:
+                masks[num] = load_region_spans(state_directory, name, windows[name])
+        return masks[num]
+
+    # make cells in the dirty windows again, from all regions that are in them
+    affected = set()
+    for dirty_window in dirty_windows:
+        label_map[dirty_window] = get_empty_label(label_map.dtype)
+        coverage[dirty_window] = 0
+        for num in find_regions(region_index, dirty_window):
+            affected.add(num)
+            window = windows[existing_regions[num]]
+            part_window = intersect_windows(dirty_window, window)
+            mask_part = get_spans_part(get_spans(num), window, part_window)
+            label_map[part_window][mask_part] = num
+            coverage[part_window] += mask_part
+
+    overlaps = create_overlaps(label_map, regions)
+    overlaps["coverage"] = coverage
+    overlaps["region_index"] = region_index
+
+    # pairs of regions that did not change are the same as before
+    changed_nums = set(names[name] for name in changed if name in windows)
+    for name_a, name_b, count in state_info["pairs"]:
+        if name_a in changed or name_b in changed or name_a not in windows or name_b not in windows:
+            continue
+        index_a = overlaps["index"][names[name_a]]
+        index_b = overlaps["index"][names[name_b]]
+        overlaps["pairs"][index_a, index_b] = count
+        overlaps["pairs"][index_b, index_a] = count
+    for num in changed_nums:
+        window = windows[existing_regions[num]]
+        for other_num in find_regions(region_index, window):
+            if other_num == num:
+                continue
+            other_window = windows[existing_regions[other_num]]
+            part_window = intersect_windows(window, other_window)
+            count = np.count_nonzero(get_spans_part(get_spans(num), window, part_window) & 
+                                     get_spans_part(get_spans(other_num), other_window, part_window))
+            overlaps["pairs"][overlaps["index"][num], overlaps["index"][other_num]] = count
+            overlaps["pairs"][overlaps["index"][other_num], overlaps["index"][num]] = count
+
+    # cells with overlaps are found again for regions in the dirty windows
+    position = {num: position for position, num in enumerate(order)}
+    for num in order:
+        name = existing_regions[num]
+        if num not in affected:
+            region_cells = load_region_cells(state_directory, name)
+        else:
+            window = windows[name]
+            overlap_cells = np.zeros(get_spans(num)["shape"], dtype=bool)
+            for other_num in find_regions(region_index, window):
+                if position[other_num] >= position[num]:
+                    continue
+                other_window = windows[existing_regions[other_num]]
+                part_window = intersect_windows(window, other_window)
+                get_mask_part(overlap_cells, window, part_window)[...] |= (
+                    get_spans_part(get_spans(num), window, part_window) & 
+                    get_spans_part(get_spans(other_num), other_window, part_window))
+            overlap_rows, overlap_cols = np.nonzero(overlap_cells)
+            region_cells = np.ravel_multi_index((overlap_rows + window[0].start, 
+                                                 overlap_cols + window[1].start), label_map.shape)
+        if region_cells.size > 0:
+            overlaps["cells"].append((num, region_cells))
+        overlaps["masks"][num] = (windows[name], masks.get(num))
+
+    # masks of regions that did not change do not need to be saved again
+    save_names = set(existing_regions[num] for num in affected)
+    if changed:
+        print("Updated " + str(len(changed)) + " changed regions and " + 
+              str(len(affected)) + " regions in the same part of the map")
+    return label_map, overlaps, save_names, state_info
+
+
+##############################################################################
+# functions for overlap policies
+##############################################################################
+
+# returns the number of a region from its number or name (or None if there is no such region)
+def get_region_num(regions, region):
+    if region in regions:
+        return region
+    for num in regions:
+        if regions[num] == region:
+            return num
+    try:
+        num = to_number(str(region))
+    except ValueError:
+        return None
+    return num if num in regions else None
+
+# returns the rank of each region added to the map for an overlap policy
+# (in a cell with more than one region, the region with the highest rank is kept):
+#   last        --> the region added last (the same as label_map)
+#   first       --> the region added first
+#   priority    --> the region that comes first in priority (list of region numbers or names),
+#                   regions not in priority come after the others (and the last added is kept)
+#   lowest      --> the region with the lowest number
+#   highest     --> the region with the highest number
+def get_policy_ranks(regions, overlaps, policy, priority=None):
+    order = overlaps["index"]
+    if policy == "last":
+        return dict(order)
+    if policy == "first":
+        return {num: -order[num] for num in order}
+    if policy in ("lowest", "highest"):
+        nums = sorted(order, reverse=(policy == "lowest"))
+        return {num: rank for rank, num in enumerate(nums)}
+    if policy == "priority":
+        ranks = dict(order)
+        priority_nums = [get_region_num(regions, region) for region in priority or []]
+        for position, num in enumerate(priority_nums):
+            if num in ranks:
+                ranks[num] = len(order) + len(priority_nums) - position
+        return ranks
+    raise ValueError("'" + str(policy) + "' is not an overlap policy (policies are: " + 
+                     ", ".join(overlap_policies) + ")")
+
+# returns the value used for cells with more than one region by the policy "conflict"
+# (one more than the largest region number if conflict_value is None)
+def get_conflict_value(regions, conflict_value=None):
+    if conflict_value is not None:
+        return int(conflict_value)
+    return int(max(regions, default=0)) + 1
+
+# returns a map for each of the overlap policies (see get_policy_ranks, and "conflict" 
+# where every cell with more than one region is set to conflict_value)
+# the maps are made from label_map (where the region added last is kept), 
+# in one pass over the masks of the regions for all policies,
+# and only the cells with more than one region are compared
+# the masks of the regions must be in overlaps (not for tiled maps)
+def resolve_overlaps(label_map, overlaps, regions, policies, priority=None, conflict_value=None):
+    overlap_cells = np.flatnonzero(overlaps["coverage"] > 1)
+    rank_policies = [policy for policy in policies if policy not in ("last", "conflict")]
+    ranks = {policy: get_policy_ranks(regions, overlaps, policy, priority) for policy in rank_policies}
+    best_ranks = {policy: np.full(overlap_cells.size, np.iinfo(np.int64).min) 
+                  for policy in rank_policies}
+    best_nums = {policy: np.zeros(overlap_cells.size, dtype=label_map.dtype) 
+                 for policy in rank_policies}
+
+    if rank_policies and overlap_cells.size > 0:
+        for num in overlaps["index"]:
+            if num not in overlaps["masks"]:
+                continue
+            window, spans = overlaps["masks"][num]
+            if spans is None:
+                raise ValueError("The mask of region '" + str(regions[num]) + "' is not known")
+            mask = get_spans_part(spans, window, window) & (overlaps["coverage"][window] > 1)
+            rows, cols = np.nonzero(mask)
+            if rows.size == 0:
+                continue
+            positions = np.searchsorted(overlap_cells, np.ravel_multi_index(
+                (rows + window[0].start, cols + window[1].start), label_map.shape))
+            for policy in rank_policies:
+                better = positions[best_ranks[policy][positions] < ranks[policy][num]]
+                best_ranks[policy][better] = ranks[policy][num]
+                best_nums[policy][better] = num
+
+    label_maps = {}
+    for policy in policies:
+        if policy == "last":
+            label_maps[policy] = label_map
+        elif policy == "conflict":
+            value = get_conflict_value(regions, conflict_value)
+            policy_map = change_label_dtype(label_map, get_label_dtype(list(regions) + [value]))
+            if policy_map is label_map:
+                policy_map = label_map.copy()
+            policy_map.flat[overlap_cells] = value
+            label_maps[policy] = policy_map
+        else:
+            policy_map = label_map.copy()
+            policy_map.flat[overlap_cells] = best_nums[policy]
+            label_maps[policy] = policy_map
+    return label_maps
+
+# returns the csv file name for the map of an overlap policy (e.g. map_first.csv)
+def get_policy_csv_name(map_csv_name, policy):
+    name, extension = os.path.splitext(map_csv_name)
+    return name + "_" + policy + extension
+
+# this function saves the map of an overlap policy as a csv file in output_directory
+# (the same as the map saved by save_files)
+def save_policy_map(label_map, area_header, area_header_labels, policy, save_csv_names, 
+                    output_directory="Outputs", run_report=None):
+    filename = get_policy_csv_name(save_csv_names["map"], policy)
+    print("Now saving map for overlap policy '" + policy + "' to: " + filename)
+    start = start_measure()
+    map_width = num_extra_left_cols + area_header["ncols"]
+    save_csv(os.path.join(output_directory, filename), 
+             get_map_rows(label_map, area_header, area_header_labels, map_width))
+    add_stage(run_report, "save map csv (" + policy + ")", start, label_map.size)
+
+
+##############################################################################
+# functions for zonal statistics (values of other rasters in each region)
+##############################################################################
+
+# returns the keys of the header that are not the same as the area, so that a raster
+# (see get_file_header) is on the same cells as the area if none are returned
+def get_grid_differences(file_header, area_header):
+    differences = [key for key in ("ncols", "nrows", "cellsize") 
+                   if file_header[key] != area_header[key]]
+    for key in ("xllcorner", "yllcorner"):
+        if (abs(file_header[key] - area_header[key]) / area_header["cellsize"] > 
+                cell_alignment_tolerance):
+            differences.append(key)
+    return differences
+
+# returns the index of the region of each cell of labels (part of a label_map) in nums 
+# (sorted array of region numbers), and a boolean array that is True for cells in a region
+def get_region_indices(labels, nums):
+    if len(nums) == 0:
+        return np.zeros(labels.shape, dtype=np.int64), np.zeros(labels.shape, dtype=bool)
+    index = np.minimum(np.searchsorted(nums, labels), len(nums) - 1)
+    return index, nums[index] == labels
+
+# returns the statistics of the values of a raster (sheet or .asc file of the source,
+# on the same cells as the area) in each region of label_map, as a dictionary:
+#   nums    --> region numbers (in order), the other arrays are in the same order
+#   count   --> number of cells with a value (blank and nodata cells are not counted)
+#   sum, min, max --> of the values (min and max are nan if there are no values)
+# the raster is streamed a block of rows at a time, and each block is added to the
+# statistics of all regions at once (np.bincount), so only one block is in memory
+# raises a ValueError if the raster is not on the same cells as the area
+def get_zonal_stats(source, name, label_map, area_header, nums):
+    if name not in source["sheetnames"]:
+        raise ValueError("A worksheet (or .asc file) with value raster name '" + name + 
+                         "' does not exist in '" + source["name"] + "'")
+    file_header, header_labels = read_grid_header(source, name)
+    differences = get_grid_differences(file_header, area_header)
+    if differences:
+        raise ValueError("Value raster '" + name + "' is not on the same cells as the area " + 
+                         "(" + ", ".join(differences) + " not the same)")
+
+    nums = np.array(sorted(nums), dtype=np.int64)
+    count = np.zeros(len(nums), dtype=np.int64)
+    total = np.zeros(len(nums))
+    minimum = np.full(len(nums), np.inf)
+    maximum = np.full(len(nums), -np.inf)
+
+    rows = iter_grid_rows(source, name, file_header)
+    for block_start in range(0, label_map.shape[0], map_rows_per_block):
+        values = np.array(list(islice(rows, map_rows_per_block)))
+        if values.size == 0:
+            break
+        labels = label_map[block_start:block_start + len(values)]
+        # cells that are not in a region, or without a value, are left out
+        index, inside = get_region_indices(labels, nums)
+        inside &= get_region_mask(values, file_header["nodata_value"])
+        index = index[inside]
+        values = values[inside]
+        count += np.bincount(index, minlength=len(nums))
+        total += np.bincount(index, weights=values, minlength=len(nums))
+        np.minimum.at(minimum, index, values)
+        np.maximum.at(maximum, index, values)
+
+    minimum[count == 0] = np.nan
+    maximum[count == 0] = np.nan
+    zonal_stats = {"nums": nums, "count": count, "sum": total, "min": minimum, "max": maximum}
+    return zonal_stats
+
+# returns the zonal statistics (see get_zonal_stats) of each value raster
+# value_rasters are names of sheets (or .asc files) of the source
+def get_all_zonal_stats(source, value_rasters, label_map, area_header, regions):
+    all_zonal_stats = {}
+    for name in value_rasters:
+        print("Now finding the statistics of: " + name)
+        all_zonal_stats[name] = get_zonal_stats(source, name, label_map, area_header, regions)
+    return all_zonal_stats
+
+# this function returns the rows with the statistics of each value raster in each region
+# (see get_all_zonal_stats), the mean is blank for regions without any values
+def list_zonal_stats(all_zonal_stats, regions):
+    yield ["value raster", "region number", "region abbreviation", "cells", "sum", 
+           "mean", "min", "max"]
+    for name in all_zonal_stats:
+        zonal_stats = all_zonal_stats[name]
+        for index, num in enumerate(zonal_stats["nums"].tolist()):
+            count = int(zonal_stats["count"][index])
+            if count == 0:
+                yield [name, num, regions[num], 0, 0, None, None, None]
+                continue
+            total = float(zonal_stats["sum"][index])
+            yield [name, num, regions[num], count, total, total / count, 
+                   float(zonal_stats["min"][index]), float(zonal_stats["max"][index])]
+
+# this function saves the zonal statistics (see get_all_zonal_stats) as a csv file 
+# in output_directory
+def save_zonal_stats(all_zonal_stats, regions, output_directory="Outputs", run_report=None):
+    print("Now saving zonal statistics to: " + zonal_stats_csv_name)
+    start = start_measure()
+    save_csv(os.path.join(output_directory, zonal_stats_csv_name), 
+             list_zonal_stats(all_zonal_stats, regions))
+    add_stage(run_report, "save zonal statistics csv", start)
+
+
+##############################################################################
+# functions for region adjacency (which regions are neighbours)
+##############################################################################
+
+# neighbours of a cell that are compared for each connectivity, as (row shift, column shift)
+# neighbours in the next row and column share an edge, diagonal neighbours only a corner
+adjacency_shifts = {
+    4   :   [(0, 1), (1, 0)],
+    8   :   [(0, 1), (1, 0), (1, 1), (1, -1)]
+}
+
+# returns the keys (index of lower region * number of regions + index of higher region)
+# of every pair of neighbouring cells in different regions, for one shift 
+# (see adjacency_shifts): cells in the first num_rows rows of index, and the cells 
+# row_shift rows down and col_shift columns right of them
+# index and inside are from get_region_indices
+def get_neighbour_keys(index, inside, num_regions, num_rows, row_shift, col_shift):
+    ncols = index.shape[1]
+    window = (slice(0, num_rows), slice(max(0, -col_shift), ncols - max(0, col_shift)))
+    shifted_window = (slice(row_shift, num_rows + row_shift), 
+                      slice(max(0, col_shift), ncols - max(0, -col_shift)))
+    index_a, index_b = index[window], index[shifted_window]
+    different = inside[window] & inside[shifted_window] & (index_a != index_b)
+    index_a, index_b = index_a[different], index_b[different]
+    return np.minimum(index_a, index_b) * num_regions + np.maximum(index_a, index_b)
+
+# returns the neighbouring regions of label_map, as a list of 
+# (region number, region number, neighbouring cell pairs, border length)
+# cells are neighbours if they share an edge (connectivity 4), or an edge or corner (8)
+# the border length is the number of shared edges times cellsize (corners add no length)
+# the map is compared with copies of itself shifted by one cell (see adjacency_shifts),
+# a block of rows at a time, and only the count of each pair of regions in each block is kept
+def get_adjacency(label_map, regions, cellsize, connectivity=4):
+    nums = np.array(sorted(regions), dtype=np.int64)
+    num_regions = len(nums)
+    block_keys, block_pairs, block_edges = [], [], []
+    nrows = label_map.shape[0]
+    for block_start in range(0, nrows, map_rows_per_block):
+        # one more row than the block, for neighbours in the next row
+        labels = label_map[block_start:block_start + map_rows_per_block + 1]
+        index, inside = get_region_indices(labels, nums)
+        block_rows = min(map_rows_per_block, nrows - block_start)
+        for row_shift, col_shift in adjacency_shifts[connectivity]:
+            num_rows = min(block_rows, len(labels) - row_shift)
+            keys, counts = np.unique(get_neighbour_keys(index, inside, num_regions, num_rows, 
+                                                        row_shift, col_shift), return_counts=True)
+            block_keys.append(keys)
+            block_pairs.append(counts)
+            # only neighbours in the same row or column share an edge
+            block_edges.append(counts if row_shift == 0 or col_shift == 0 else 0 * counts)
+
+    keys, inverse = np.unique(np.concatenate(block_keys), return_inverse=True)
+    pairs = np.bincount(inverse, weights=np.concatenate(block_pairs), minlength=len(keys))
+    edges = np.bincount(inverse, weights=np.concatenate(block_edges), minlength=len(keys))
+
+    adjacency = []
+    for key, num_pairs, num_edges in zip(keys.tolist(), pairs.tolist(), edges.tolist()):
+        num_a, num_b = nums[key // num_regions], nums[key % num_regions]
+        adjacency.append((int(num_a), int(num_b), int(num_pairs), int(num_edges) * cellsize))
+    return adjacency
+
+# this function returns the rows with each pair of neighbouring regions (see get_adjacency)
+def list_adjacency(adjacency, regions):
+    yield ["region number", "region abbreviation", "region number", "region abbreviation", 
+           "neighbouring cell pairs", "border length"]
+    for num_a, num_b, num_pairs, border_length in adjacency:
+        yield [num_a, regions[num_a], num_b, regions[num_b], num_pairs, border_length]
+
+# this function saves the neighbouring regions (see get_adjacency) as a csv file
+# in output_directory
+def save_adjacency(adjacency, regions, output_directory="Outputs", run_report=None):
+    print("Now saving adjacency of regions to: " + adjacency_csv_name)
+    start = start_measure()
+    save_csv(os.path.join(output_directory, adjacency_csv_name), list_adjacency(adjacency, regions))
+    add_stage(run_report, "save adjacency csv", start)
+
+
+##############################################################################
+# functions for aggregation levels (e.g. regions --> provinces --> interconnections)
+##############################################################################
+
+# returns the regions of an aggregation level, and the parent number of each region:
+#   level_regions   --> parent number --> parent name, numbered from 1 in the order that 
+#                       the parents first appear in regions
+#   parent_nums     --> region number --> parent number (regions without a parent are not in it)
+# parents is region number --> parent name (see get_region_parents in "user_inputs.py")
+def get_level_regions(regions, parents):
+    level_regions, parent_nums, names = {}, {}, {}
+    for num in regions:
+        if num not in parents:
+            continue
+        name = parents[num]
+        if name not in names:
+            names[name] = len(names) + 1
+            level_regions[names[name]] = name
+        parent_nums[num] = names[name]
+    return level_regions, parent_nums
+
+# returns the lookup table of an aggregation level: the parent number of each of nums 
+# (sorted array of region numbers, see get_region_indices), then the empty label 
+# (for cells without a region), as an array of dtype
+def get_level_lookup(nums, parent_nums, dtype):
+    empty_label = get_empty_label(dtype)
+    lookup = np.full(len(nums) + 1, empty_label, dtype=dtype)
+    for index, num in enumerate(nums.tolist()):
+        lookup[index] = parent_nums.get(num, empty_label)
+    return lookup
+
+# returns the map of an aggregation level: label_map with the number of each region changed 
+# to the number of its parent (see get_level_regions), and the empty label where a cell has 
+# no region, or its region has no parent (e.g. the conflict value of overlap policy "conflict")
+# each cell is changed with one lookup in a table (a block of rows at a time), 
+# so the regions do not have to be added to a map again for each level
+# if filename is given, the map is kept in that file (memory-mapped, e.g. for tiled maps)
+def get_level_map(label_map, regions, level_regions, parent_nums, filename=None):
+    nums = np.array(sorted(regions), dtype=np.int64)
+    lookup = get_level_lookup(nums, parent_nums, get_label_dtype(level_regions))
+    # for small label types, the table has every label value (no search for the region index)
+    table = None
+    if label_map.dtype.itemsize <= 2:
+        table = np.full(np.iinfo(label_map.dtype).max + 1, lookup[-1], dtype=lookup.dtype)
+        table[nums] = lookup[:-1]
+
+    if filename is None:
+        level_map = np.empty(label_map.shape, dtype=lookup.dtype)
+    else:
+        level_map = np.lib.format.open_memmap(filename, mode='w+', dtype=lookup.dtype, 
+                                              shape=label_map.shape)
+    for block_start in range(0, label_map.shape[0], map_rows_per_block):
+        block = slice(block_start, block_start + map_rows_per_block)
+        if table is not None:
+            level_map[block] = table[label_map[block]]
+        else:
+            index, inside = get_region_indices(label_map[block], nums)
+            level_map[block] = lookup[np.where(inside, index, len(nums))]
+    return level_map
+
+# returns the csv file name of the map or legend of an aggregation level (e.g. map_province.csv)
+def get_level_csv_name(csv_name, level):
+    name, extension = os.path.splitext(csv_name)
+    return name + "_" + level + extension
+
+# this function saves the map and legend of an aggregation level as csv files 
+# in output_directory (the same as the map and legend saved by save_files)
+def save_level(level, level_map, level_regions, area_header, area_header_labels, 
+               save_csv_names, output_directory="Outputs", run_report=None):
+    map_name = get_level_csv_name(save_csv_names["map"], level)
+    legend_name = get_level_csv_name(save_csv_names["legend"], level)
+    print("Now saving map and legend for level '" + level + "' to: " + map_name + 
+          ", " + legend_name)
+    start = start_measure()
+    map_width = num_extra_left_cols + area_header["ncols"]
+    save_csv(os.path.join(output_directory, map_name), 
+             get_map_rows(level_map, area_header, area_header_labels, map_width))
+    save_csv(os.path.join(output_directory, legend_name), create_legend(level_regions))
+    add_stage(run_report, "save level csv (" + level + ")", start, level_map.size)
+
+# this function makes the map of each aggregation level from label_map (see get_level_map),
+# and saves it (see save_level)
+# all_parents is level --> region number --> parent name (see get_region_parents)
+# the map of each level is saved before the next one is made, so only one is kept in memory
+# if directory is given (e.g. the folder of a tiled map), the map of each level is kept 
+# in a file in the directory instead of in memory
+def save_levels(label_map, area_header, area_header_labels, regions, all_parents, 
+                save_csv_names, output_directory="Outputs", run_report=None, directory=None):
+    for number, level in enumerate(all_parents):
+        start = start_measure()
+        level_regions, parent_nums = get_level_regions(regions, all_parents[level])
+        filename = None
+        if directory is not None:
+            filename = os.path.join(directory, "level_map_" + str(number) + ".npy")
+        level_map = get_level_map(label_map, regions, level_regions, parent_nums, filename)
+        add_stage(run_report, "make level map (" + level + ")", start, label_map.size)
+        save_level(level, level_map, level_regions, area_header, area_header_labels, 
+                   save_csv_names, output_directory, run_report)
+        del level_map
+
+
+##############################################################################
+# functions for previews (small downsampled maps)
+##############################################################################
+
+# returns the preview of label_map downsampled by factor (see downsample_mode in 
+# map_preview.py), as the index of the region of each cell in nums (sorted array of 
+# region numbers), or len(nums) for cells without a region
+# the map is downsampled a band of rows at a time
+def get_preview_index(label_map, nums, factor):
+    band_rows = factor * max(1, map_rows_per_block // factor)
+    bands = []
+    for band_start in range(0, label_map.shape[0], band_rows):
+        index, inside = get_region_indices(label_map[band_start:band_start + band_rows], nums)
+        index = np.where(inside, index, len(nums)).astype(np.int32)
+        bands.append(downsample_mode(index, factor, len(nums) + 1))
+    return np.vstack(bands)
+
+# returns the header of a preview downsampled by factor (see get_file_header)
+# the top left corner is the same as the area, and each cell is factor cells wide
+def get_preview_header(area_header, factor):
+    preview_header = dict(area_header)
+    preview_header["ncols"] = -(-area_header["ncols"] // factor)
+    preview_header["nrows"] = -(-area_header["nrows"] // factor)
+    preview_header["cellsize"] = area_header["cellsize"] * factor
+    top = area_header["yllcorner"] + area_header["nrows"] * area_header["cellsize"]
+    preview_header["yllcorner"] = top - preview_header["nrows"] * preview_header["cellsize"]
+    return preview_header
+
+# returns True if a map with the header fits in an excel worksheet
+def fits_in_excel(file_header):
+    return (num_extra_left_cols + file_header["ncols"] <= excel_max_cols and 
+            num_extra_top_rows + file_header["nrows"] <= excel_max_rows)
+
+# returns the file name of the preview of a map (map.csv --> map_preview_4.png)
+def get_preview_name(map_csv_name, factor, preview_format):
+    return os.path.splitext(map_csv_name)[0] + "_preview_" + str(factor) + "." + preview_format
+
+# this function saves a preview of the map for each of factors, as preview_format:
+#   png, ppm    --> an image with one colour for each region (white where there is no region)
+#   xlsx        --> a formatted map (see save_formatted_map) of the downsampled map
+# each cell of a preview is the most common region in factor x factor cells of the map
+def save_previews(label_map, area_header, area_header_labels, regions, factors, 
+                  preview_format="png", map_csv_name="map.csv", output_directory="Outputs", 
+                  run_report=None):
+    nums = np.array(sorted(regions), dtype=np.int64)
+    for factor in factors:
+        filename = get_preview_name(map_csv_name, factor, preview_format)
+        preview_header = get_preview_header(area_header, factor)
+        if preview_format == "xlsx" and not fits_in_excel(preview_header):
+            print("WARNING: the preview for factor " + str(factor) + " (" + 
+                  str(preview_header["ncols"]) + " x " + str(preview_header["nrows"]) + 
+                  ") does not fit in an excel worksheet and was not saved")
+            continue
+        print("Now saving preview (1 cell for every " + str(factor) + " x " + str(factor) + 
+              " cells) to: " + filename)
+        start = start_measure()
+        index = get_preview_index(label_map, nums, factor)
+        filename = os.path.join(output_directory, filename)
+        if preview_format == "xlsx":
+            labels = np.append(nums, get_empty_label(label_map.dtype)).astype(label_map.dtype)
+            save_formatted_map(filename, 
+                               get_map_rows(labels[index], preview_header, area_header_labels),
+                               preview_header, get_area_cell_info(preview_header))
+        elif preview_format == "ppm":
+            write_ppm(filename, get_preview_image(index, len(nums)))
+        else:
+            write_png(filename, get_preview_image(index, len(nums)))
+        add_stage(run_report, "save preview " + str(factor), start, label_map.size)
+
+
+# this function returns a copy of label_map where blanks are set to the no data value
 # information from the area sheet is used 
-def set_blanks_to_nodata(map_ws, area_header, area_cell_info):
-    ncols = area_header["ncols"]
-    nrows = area_header["nrows"]
+# the copy has the smallest type that fits both the region numbers and the no data value
+def set_blanks_to_nodata(label_map, area_header):
     nodata_value = area_header["nodata_value"]
-    area_top_left_row = area_cell_info["top_left_row"]
-    area_top_left_col = area_cell_info["top_left_col"]
-    
-    for row in range(nrows):
-            for col in range(ncols):
-                cell_val = map_ws.cell(row=row + num_extra_top_rows + 1, 
-                                            column=col + num_extra_left_cols + 1).value
-                if (cell_val == "") or (cell_val == None):
-                    map_ws.cell(row=area_top_left_row + row, 
-                                    column=area_top_left_col + col).value = nodata_value
+    if isinstance(nodata_value, float) and nodata_value.is_integer():
+        nodata_value = int(nodata_value)
+    # a float no data value keeps all of its digits
+    nodata_dtype = np.min_scalar_type(nodata_value) if isinstance(nodata_value, int) else np.float64
+    map_values = label_map.astype(np.promote_types(label_map.dtype, nodata_dtype))
+    map_values[label_map == get_empty_label(label_map.dtype)] = nodata_value
+    return map_values
+
+# returns the rows of the map: the header rows of the area, then the values
+# (with blanks set to the no data value, a block of rows at a time)
+# if width is given, header rows are padded with blanks to this width
+def get_map_rows(label_map, area_header, area_header_labels, width=None):
+    for num, key in enumerate(area_header):
+        row = [area_header_labels[num], area_header[key]]
+        if width is not None and width > len(row):
+            row += [None] * (width - len(row))
+        yield row
+
+    left_cols = [None] * num_extra_left_cols
+    for block_start in range(0, label_map.shape[0], map_rows_per_block):
+        map_values = set_blanks_to_nodata(label_map[block_start:block_start + map_rows_per_block], 
+                                          area_header)
+        for row in map_values:
+            yield left_cols + row.tolist()
 
 # this function sets column_width to user-defined variable
 # taken from https://stackoverflow.com/a/60801712
-def set_column_width(map_ws):
+# the columns are set before any rows are written, so that it can be used
+# with a write-only worksheet
+def set_column_width(map_ws, area_header):
+    from openpyxl.worksheet.dimensions import ColumnDimension, DimensionHolder
     col_width = 2
     dim_holder = DimensionHolder(worksheet=map_ws)
 
-    for col in range(map_ws.min_column, map_ws.max_column + 1):
+    for col in range(1, num_extra_left_cols + area_header['ncols'] + 1):
         dim_holder[get_column_letter(col)] = ColumnDimension(map_ws, min=col, max=col, width=col_width)
 
     map_ws.column_dimensions = dim_holder
@@ -227,6 +1653,7 @@ def set_column_width(map_ws):
 # this function sets a color scale for range within borders of map_ws
 # colours and scales set by user above
 def set_color_scale(map_ws, area_header, area_cell_info):
+    from openpyxl.formatting.rule import ColorScaleRule
     # the following is for the color scale
     color_start_value = 00 # percentage (between 0-100)
     color_start_value_color = 'ED5F49' # light red
@@ -252,81 +1679,358 @@ def set_color_scale(map_ws, area_header, area_cell_info):
     map_ws.conditional_formatting.add(range_to_format, colorscale_rule)
 
 
-# this function formats map_ws
-def format_map_ws(map_ws, area_ws, area_header, area_cell_info, format_map):
-    # set header of map_ws to be the same as area_ws
-    set_headers_equal(map_ws, area_ws)
-    # set to nodata value (of area) if blank
-    set_blanks_to_nodata(map_ws, area_header, area_cell_info)
-
-    if format_map:
-        # set column width
-        set_column_width(map_ws)
-        # conditional format cells
-        set_color_scale(map_ws, area_header, area_cell_info)
-
-# this function prints the region names and numbers into legend_ws
-def create_legend(legend_ws, regions):
-    row = 1
-    col1 = 1
-    col2 = 2
-
-    legend_ws.cell(row=row, column=col1).value = "region number" 
-    legend_ws.cell(row=row, column=col2).value = "region abbreviation"
+# this function formats map_ws (before any rows are written to it)
+def format_map_ws(map_ws, area_header, area_cell_info):
+    # set column width
+    set_column_width(map_ws, area_header)
+    # conditional format cells
+    set_color_scale(map_ws, area_header, area_cell_info)
 
+# this function returns the rows with the region names and numbers for the legend
+def create_legend(regions):
+    yield ["region number", "region abbreviation"]
     for num in regions:
-        row += 1
-        legend_ws.cell(row=row, column=col1).value = num 
-        legend_ws.cell(row=row, column=col2).value = regions[num]
-
-# this function prints the region names and numbers into legend_ws
-def print_overlaps(overlaps_ws, overlaps):
-    row = 1
-    col = 1
-
-    overlaps_ws.cell(row=row, column=col).value = "list of cells with overlaps" 
-
-    for cell in overlaps:
-        row += 1
-        overlaps_ws.cell(row=row, column=col).value = cell
-
-
-# this function saves the sheets 'map' and 'legend' and 'overlaps' into new workbook
-def save_files(wb, save_wb_name, save_csv_names, format_map):
-    directory = 'Outputs/'
+        yield [num, regions[num]]
+
+# this function returns the rows for the overlaps, in one of the overlaps_formats:
+#   cells   --> one row for each cell with an overlap (for each extra region in the cell)
+#   runs    --> one row for each run of cells in a row with the same number of regions
+#   pairs   --> one row for each pair of regions that overlap, with the number of cells
+def list_overlaps(overlaps, overlaps_format="cells"):
+    if overlaps_format == "runs":
+        yield ["first cell", "last cell", "number of regions"]
+        for run in get_overlap_runs(overlaps):
+            yield list(run)
+    elif overlaps_format == "pairs":
+        yield ["region number", "region number", "cells with overlaps"]
+        for pair in get_overlap_pairs(overlaps):
+            yield list(pair)
+    else:
+        yield ["list of cells with overlaps"]
+        for cell in get_overlap_addresses(overlaps):
+            yield [cell]
+
+# this function writes the rows into a csv file
+# rows are written as they are made, through a large write buffer
+def save_csv(filename, rows):
+    with open(filename, 'w', newline='', buffering=csv_buffer_size) as file:
+        writer = csv.writer(file)
+        writer.writerows(rows)
+
+# returns a text file opened for writing with zstandard compression
+# (needs python 3.14 or later, or the package 'zstandard')
+def open_zstd_text_file(filename):
+    try:
+        from compression import zstd
+        return zstd.open(filename, 'wt', newline='')
+    except ImportError:
+        pass
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("The package 'zstandard' is needed to save '" + filename + "'")
+    return zstandard.open(filename, 'wt', newline='')
+
+# this function writes the rows into a compressed csv file ("csv.gz" or "csv.zst")
+def save_compressed_csv(filename, rows, map_format):
+    if map_format == "csv.zst":
+        file = open_zstd_text_file(filename)
+    else:
+        file = gzip.open(filename, 'wt', newline='', compresslevel=gzip_level)
+    with file:
+        writer = csv.writer(file)
+        writer.writerows(rows)
+
+# this function writes the map as an .asc file, with the header of the area
+# (blanks are set to the no data value, a block of rows at a time)
+def save_asc_map(filename, label_map, area_header, area_header_labels):
+    with open(filename, 'w', buffering=csv_buffer_size) as file:
+        write_asc_header(file, area_header, area_header_labels)
+        for block_start in range(0, label_map.shape[0], map_rows_per_block):
+            write_asc_values(file, set_blanks_to_nodata(
+                label_map[block_start:block_start + map_rows_per_block], area_header))
+
+# this function writes the map (with blanks set to the no data value) as a .npy file,
+# which can be memory-mapped by other programs (np.load(filename, mmap_mode='r'))
+# the file is filled a block of rows at a time, so the map is never copied all at once
+def save_npy_map(filename, label_map, area_header):
+    npy_map = None
+    for block_start in range(0, label_map.shape[0], map_rows_per_block):
+        map_values = set_blanks_to_nodata(label_map[block_start:block_start + map_rows_per_block], 
+                                          area_header)
+        if npy_map is None:
+            npy_map = np.lib.format.open_memmap(filename, mode='w+', dtype=map_values.dtype, 
+                                                shape=label_map.shape)
+        npy_map[block_start:block_start + len(map_values)] = map_values
+    if npy_map is not None:
+        npy_map.flush()
+        del npy_map
+
+# this function writes the map (with blanks set to the no data value) as a compressed
+# .npz file, with the array 'map' and one array for each key of the area header
+# the array 'map' is compressed a block of rows at a time (the same file as 
+# np.savez_compressed), so the map is never copied all at once
+def save_npz_map(filename, label_map, area_header):
+    dtype = set_blanks_to_nodata(label_map[:0], area_header).dtype
+    with zipfile.ZipFile(filename, 'w', compression=zipfile.ZIP_DEFLATED) as npz_file:
+        with npz_file.open("map.npy", 'w', force_zip64=True) as file:
+            np.lib.format.write_array_header_1_0(file, {
+                "descr"         :   np.lib.format.dtype_to_descr(dtype),
+                "fortran_order" :   False,
+                "shape"         :   label_map.shape
+            })
+            for block_start in range(0, label_map.shape[0], map_rows_per_block):
+                map_values = set_blanks_to_nodata(
+                    label_map[block_start:block_start + map_rows_per_block], area_header)
+                file.write(np.ascontiguousarray(map_values, dtype=dtype).tobytes())
+        for key in area_header:
+            with npz_file.open(key + ".npy", 'w') as file:
+                np.lib.format.write_array(file, np.asarray(area_header[key]))
+
+# returns the file name of the map in another of map_formats (map.csv --> map.npy)
+def get_map_format_name(map_csv_name, map_format):
+    return os.path.splitext(map_csv_name)[0] + "." + map_format
+
+# this function saves the map in one of map_formats (other than "csv")
+def save_map_format(filename, map_format, label_map, area_header, area_header_labels):
+    if map_format == "asc":
+        save_asc_map(filename, label_map, area_header, area_header_labels)
+    elif map_format == "npy":
+        save_npy_map(filename, label_map, area_header)
+    elif map_format == "npz":
+        save_npz_map(filename, label_map, area_header)
+    else:
+        map_width = num_extra_left_cols + area_header["ncols"]
+        save_compressed_csv(filename, get_map_rows(label_map, area_header, area_header_labels, 
+                                                   map_width), map_format)
+
+# this function runs function(*args) to save a file, and adds it to run_report as a stage
+# (if stage is not None)
+def save_and_measure(run_report, stage, cells, function, *args):
+    start = start_measure()
+    function(*args)
+    if stage is not None:
+        add_stage(run_report, stage, start, cells)
+
+# this function writes the rows of the map into a new (write-only) workbook
+# formatting is set up front, and rows are streamed into the workbook
+# formatting, adding the rows and saving the workbook are added to run_report as stages
+def save_formatted_map(filename, map_rows, area_header, area_cell_info, run_report=None):
+    from openpyxl import Workbook
+    num_cells = area_header["ncols"] * area_header["nrows"]
+    wb = Workbook(write_only=True)
+    map_ws = wb.create_sheet("map")
+    start = start_measure()
+    format_map_ws(map_ws, area_header, area_cell_info)
+    add_stage(run_report, "format_map_ws", start)
+
+    start = start_measure()
+    for row in map_rows:
+        map_ws.append(row)
+    add_stage(run_report, "write formatted map", start, num_cells)
+
+    start = start_measure()
+    wb.save(filename)
+    add_stage(run_report, "save formatted map workbook", start, num_cells)
+
+# this function saves the map, legend and overlaps as csv files, the map in each of
+# the other map_formats (see save_map_format), and the formatted map into a new workbook 
+# (if format_map), in output_directory
+# every file is written in its own thread, so saving takes about as long as the slowest
+# file (numpy, compression and writing to disk do not hold the python lock)
+# saving each file is added to run_report as a stage
+def save_files(label_map, area_header, area_header_labels, area_cell_info, regions, overlaps,
+               save_wb_name, save_csv_names, format_map, overlaps_format="cells", run_report=None,
+               output_directory="Outputs", map_formats=("csv",)):
+    directory = os.path.join(output_directory, '')
     if not os.path.exists(directory):
         os.makedirs(directory)
-    # save sheets into csv file
-    # using code inspired by https://stackoverflow.com/a/10803229
-    save_sheets = ['map', 'legend', 'overlaps']
-    for ws_name in save_sheets:
-        print("Now saving " + ws_name + " to: " + save_csv_names[ws_name])
-
-        with open(directory + save_csv_names[ws_name],'w', newline='') as file:
-            writer = csv.writer(file)
-            for row in wb[ws_name].rows:
-                writer.writerow([cell.value for cell in row])
+
+    # (what is saved, file name, stage, cells, function, arguments) of each file
+    save_tasks = []
+    if "csv" in map_formats:
+        # header rows of map.csv are as wide as the rest of the map
+        map_width = num_extra_left_cols + area_header["ncols"]
+        save_tasks.append(("map", save_csv_names["map"], "save map csv", label_map.size, save_csv, 
+                           get_map_rows(label_map, area_header, area_header_labels, map_width)))
+    save_tasks.append(("legend", save_csv_names["legend"], "save legend csv", 0, save_csv, 
+                       create_legend(regions)))
+    save_tasks.append(("overlaps", save_csv_names["overlaps"], "save overlaps csv", 0, save_csv, 
+                       list_overlaps(overlaps, overlaps_format)))
+    for map_format in map_formats:
+        if map_format != "csv":
+            filename = get_map_format_name(save_csv_names["map"], map_format)
+            save_tasks.append(("map", filename, "save map " + map_format, label_map.size, 
+                               save_map_format, map_format, label_map, area_header, 
+                               area_header_labels))
+    if format_map and not fits_in_excel(area_header):
+        print("WARNING: the map (" + str(area_header["ncols"]) + " x " + 
+              str(area_header["nrows"]) + ") does not fit in an excel worksheet, so the " + 
+              "formatted map was not saved (see 'preview_factors' for smaller maps)")
+        format_map = False
+    if format_map:
+        # the stages of the formatted map are added by save_formatted_map
+        save_tasks.append(("formatted map", save_wb_name, None, 0, save_formatted_map, 
+                           get_map_rows(label_map, area_header, area_header_labels),
+                           area_header, area_cell_info, run_report))
+
+    with ThreadPoolExecutor(max_workers=len(save_tasks)) as executor:
+        futures = []
+        for name, filename, stage, cells, function, *args in save_tasks:
+            print("Now saving " + name + " to: " + filename)
+            futures.append(executor.submit(save_and_measure, run_report, stage, cells, function, 
+                                           directory + filename, *args))
+        for future in futures:
+            future.result()
     
-    # save only sheet 'map' by removing other sheets
-    # code copied from https://stackoverflow.com/a/46237894
     if format_map:
-        sheets = wb.sheetnames
-        for ws_name in sheets:
-            if (ws_name != 'map'):
-                wb.remove(wb[ws_name])
-
-        print("Now saving formatted map to workbook: " + save_wb_name)
-        wb.save(directory + save_wb_name)
         print("Everything has been saved")
 
 
 
 
+##############################################################################
+# functions for using regionalization.py as a library
+##############################################################################
+
+# returns the regionalized map of an input (excel workbook or folder of .asc files),
+# without asking the user anything and without saving any files
+#   area_name   --> name of the sheet (or .asc file) of the entire area
+#   regions     --> 'list' to use the sheet 'list', or a dictionary of region number --> name
+#   xlFilename  --> input excel workbook or folder of .asc files, or an input source that
+#                   was already loaded (see load_input_source), which is then not closed
+#   workers     --> number of processes used to read regions
+#   input_cache --> cache of parsed sheets (see input_cache.py), e.g. kept between calls
+#   resample    --> "nearest" or "majority" to resample regions with a different cellsize 
+#                   than the area (see resampling.py), "off" to not resample them
+#   value_rasters --> names of sheets (or .asc files) on the same cells as the area, 
+#                   to find the statistics of in each region (see get_zonal_stats)
+#   levels      --> names of aggregation levels, with the parents of each region in the 
+#                   sheet 'list' (see get_region_parents, regions must be 'list')
+# the result is a dictionary:
+#   label_map   --> array of region numbers, empty_label where there is no region
+#                   (see set_blanks_to_nodata for the map with the no data value instead)
+#   empty_label --> value in label_map for cells that are not part of any region
+#   area_header, area_header_labels, area_cell_info --> information about the area
+#   regions     --> region number --> name
+#   legend      --> rows of the legend (see create_legend)
+#   overlaps    --> overlaps of regions (see create_overlaps, and list_overlaps for rows)
+#   label_maps  --> overlap policy --> map, for each of overlap_policies (see resolve_overlaps),
+#                   label_map is the map of the first policy
+#   problems    --> problems found in the headers of the inputs (see check_inputs)
+#   zonal_stats --> value raster --> statistics in each region of label_map (see get_zonal_stats)
+#   levels      --> level --> {"regions": parent number --> name, "label_map": map of parents}
+#                   (see get_level_regions and get_level_map)
+# problems with the inputs raise a ValueError (unless validate is "warn" or "off", 
+# then only problems that stop the map from being made raise a ValueError)
+def regionalize(area_name, regions="list", xlFilename=default_xlFilename, workers=1,
+                input_cache=None, run_report=None, overlap_policies=("last",), priority=None, 
+                conflict_value=None, validate="strict", resample="off", value_rasters=(), 
+                levels=()):
+    if isinstance(xlFilename, dict):
+        source = xlFilename
+    else:
+        if not os.path.exists(xlFilename):
+            raise ValueError("Input file '" + xlFilename + "' does not exist")
+        source = load_input_source(xlFilename, quiet=True, input_cache=input_cache)
+
+    try:
+        if area_name not in source["sheetnames"]:
+            raise ValueError("No sheet with name '" + area_name + "' was found")
+        all_parents = {}
+        if levels:
+            if regions != "list":
+                raise ValueError("'levels' needs the regions (and their parents) from " + 
+                                 "the sheet 'list'")
+            all_parents = get_region_parents(source, list(levels))
+        regions = get_source_regions(source, regions)
+        check_conflict_value(conflict_value, regions)
+        problems = []
+        if validate != "off":
+            problems = check_inputs(source, area_name, regions, resample, value_rasters)
+            if validate != "warn" and any(problem["severity"] == "ERROR" for problem in problems):
+                raise ValueError(get_input_errors_message(problems))
+
+        area_header, area_header_labels = read_grid_header(source, area_name)
+        area_cell_info = get_area_cell_info(area_header)
+        label_map = create_label_map(area_header, dtype=get_label_dtype(regions))
+        overlaps = create_overlaps(label_map, regions)
+        each_region(source, regions, label_map, area_header, area_cell_info, overlaps, workers,
+                    run_report, resample)
+
+        label_maps = resolve_overlaps(label_map, overlaps, regions, list(overlap_policies), 
+                                      priority, conflict_value)
+        label_map = label_maps[overlap_policies[0]]
+        all_zonal_stats = get_all_zonal_stats(source, value_rasters, label_map, area_header, 
+                                              regions)
+    finally:
+        if source is not xlFilename:
+            close_input_source(source)
+
+    level_maps = {}
+    for level in all_parents:
+        level_regions, parent_nums = get_level_regions(regions, all_parents[level])
+        level_maps[level] = {
+            "regions"       :   level_regions,
+            "label_map"     :   get_level_map(label_map, regions, level_regions, parent_nums)
+        }
+
+    result = {
+        "label_map"         :   label_map,
+        "empty_label"       :   get_empty_label(label_map.dtype),
+        "area_header"       :   area_header,
+        "area_header_labels":   area_header_labels,
+        "area_cell_info"    :   area_cell_info,
+        "regions"           :   regions,
+        "legend"            :   list(create_legend(regions)),
+        "overlaps"          :   overlaps,
+        "label_maps"        :   label_maps,
+        "problems"          :   problems,
+        "zonal_stats"       :   all_zonal_stats,
+        "levels"            :   level_maps
+    }
+    return result
+
+# this function saves the result of regionalize in output_directory (see save_files)
+def save_result(result, save_csv_names=None, format_map=False, save_wb_name=default_save_wb_name,
+                overlaps_format="cells", run_report=None, output_directory="Outputs", 
+                map_formats=("csv",), preview_factors=(), preview_format="png"):
+    if overlaps_format not in overlaps_formats:
+        raise ValueError("'overlaps_format' must be one of: " + ", ".join(overlaps_formats))
+    check_map_formats(list(map_formats))
+    csv_names = dict(default_save_csv_names)
+    csv_names.update(save_csv_names or {})
+    save_files(result["label_map"], result["area_header"], result["area_header_labels"], 
+               result["area_cell_info"], result["regions"], result["overlaps"],
+               save_wb_name, csv_names, format_map, overlaps_format, run_report, output_directory,
+               map_formats)
+    if result.get("zonal_stats"):
+        save_zonal_stats(result["zonal_stats"], result["regions"], output_directory, run_report)
+    for level in result.get("levels") or {}:
+        save_level(level, result["levels"][level]["label_map"], result["levels"][level]["regions"],
+                   result["area_header"], result["area_header_labels"], csv_names, 
+                   output_directory, run_report)
+    if preview_factors:
+        save_previews(result["label_map"], result["area_header"], result["area_header_labels"], 
+                      result["regions"], preview_factors, preview_format, csv_names["map"], 
+                      output_directory, run_report)
+
+
+
 ##############################################################################
 # global variables
 ##############################################################################
 num_extra_top_rows = 6 # the top of every asc file has 6 extra rows
 num_extra_left_cols = 1 # the left of every asc file has 1 extra column
+label_dtypes = (np.uint8, np.uint16, np.uint32) # types tried for the map (see get_label_dtype)
+csv_buffer_size = 1024 * 1024 # bytes of csv output kept in memory before writing to file
+map_rows_per_block = 256 # rows of the map saved (or used for zonal statistics) at once
+zonal_stats_csv_name = "zonal_stats.csv" # file with the statistics of value rasters in each region
+adjacency_csv_name = "adjacency.csv" # file with each pair of neighbouring regions
+gzip_level = 6 # compression level of maps saved as "csv.gz" (1 fastest to 9 smallest)
+excel_max_cols = 16384 # most columns in an excel worksheet
+excel_max_rows = 1048576 # most rows in an excel worksheet
+cell_alignment_tolerance = 1e-6 # fraction of a cell that a region can be off the cells of the area
    
 
 
@@ -336,45 +2040,249 @@ num_extra_left_cols = 1 # the left of every asc file has 1 extra column
 
 
 
-def main():
+# this function makes the map from the variables (see define_all_variables)
+# with the options in job (None for the defaults), and saves all files
+# start is when reading the inputs began (see start_measure)
+# errors found in the headers of the inputs (see check_inputs) raise a ValueError
+def make_and_save_map(variables, job, start):
     line_end = "===================="
     line_begin = "\n" + line_end
 
-    xlFilename, wb, save_csv_names, format_map, save_wb_name, area_name, regions = define_all_variables()
-   
-    # create sheets in workbook for regionalized map, legend, and overlaps
-    map_ws = wb.create_sheet("map")
-    legend_ws = wb.create_sheet("legend")
-    overlaps_ws = wb.create_sheet("overlaps")
-    
-    # area worksheet
-    area_ws = wb[area_name]
-    area_header = get_file_header(area_ws)
+    xlFilename, source, save_csv_names, format_map, save_wb_name, area_name, regions = variables
+    workers = get_workers(job)
+    overlaps_format = get_job_option(job, "overlaps_format")
+    tile_rows = int(get_job_option(job, "tile_rows"))
+    state_directory = get_job_option(job, "state_directory")
+    run_report_name = get_job_option(job, "run_report")
+    profile_name = get_job_option(job, "profile")
+    output_directory = get_job_option(job, "output_directory")
+    validate = get_job_option(job, "validate")
+    resample = get_job_option(job, "resample")
+    value_rasters = get_value_rasters(job)
+    connectivity = int(get_job_option(job, "adjacency"))
+    map_formats = get_map_formats(job)
+    preview_factors = get_preview_factors(job)
+    preview_format = get_job_option(job, "preview_format")
+    checkpoint_directory = get_job_option(job, "checkpoint_directory")
+    levels = get_levels(job)
+
+    # time, cells and memory of each stage and region are kept in run_report (see run_report.py)
+    run_report = None
+    if run_report_name:
+        run_report = create_run_report({
+            "input"             :   xlFilename,
+            "area_name"         :   area_name,
+            "regions"           :   len(regions),
+            "workers"           :   workers,
+            "overlaps_format"   :   overlaps_format,
+            "tile_rows"         :   tile_rows,
+            "state_directory"   :   state_directory,
+            "resample"          :   resample,
+            "value_rasters"     :   value_rasters,
+            "adjacency"         :   connectivity,
+            "map_formats"       :   map_formats,
+            "preview_factors"   :   preview_factors,
+            "checkpoint_directory": checkpoint_directory,
+            "levels"            :   levels,
+            "format_map"        :   format_map
+        })
+    add_stage(run_report, "read inputs", start)
+
+    # parents of each region at each aggregation level, from the sheet 'list'
+    all_parents = {}
+    if levels:
+        try:
+            all_parents = get_region_parents(source, levels)
+        except ValueError:
+            close_input_source(source)
+            raise
+
+    # check the headers of the area and all regions before reading anything else
+    if validate != "off":
+        print(line_begin, "Checking the inputs", line_end)
+        start = start_measure()
+        problems = check_inputs(source, area_name, regions, resample, value_rasters)
+        add_stage(run_report, "check inputs", start)
+        print_input_problems(problems, len(regions))
+        if run_report is not None:
+            run_report["input_problems"] = problems
+        if validate != "warn" and any(problem["severity"] == "ERROR" for problem in problems):
+            close_input_source(source)
+            raise ValueError(get_input_errors_message(problems))
+        if validate == "only":
+            close_input_source(source)
+            return
+
+    # area worksheet (or .asc file)
+    start = start_measure()
+    area_header, area_header_labels = read_grid_header(source, area_name)
     area_cell_info = get_area_cell_info(area_header)
+    add_stage(run_report, "read area header", start)
+    if run_report is not None:
+        run_report["settings"]["ncols"] = area_header["ncols"]
+        run_report["settings"]["nrows"] = area_header["nrows"]
+
+    # update the map saved by an earlier run, if there is one
+    update = None
+    if state_directory is not None:
+        print(line_begin, "Updating the saved regionalization map", line_end)
+        start = start_measure()
+        update = update_from_state(state_directory, source, area_name, area_header, 
+                                   area_cell_info, regions, resample)
+        add_stage(run_report, "update from state", start)
+
+    # for tiled processing, the map is kept on disk in a temporary folder
+    tile_directory = None
+    if tile_rows > 0:
+        tile_directory = tempfile.mkdtemp(prefix="regionalization_", 
+                                          dir=get_job_option(job, "tile_directory"))
+
+    # the temporary folder is removed even if making or saving the map stops with an error
+    try:
+        # the making of the map can be profiled (saved as a cProfile file in output_directory)
+        profiler = None
+        if profile_name:
+            profiler = cProfile.Profile()
+            profiler.enable()
+
+        if update is not None:
+            label_map, overlaps, save_names, old_state_info = update
+        else:
+            save_names, old_state_info = None, None
+            # map of region numbers (only the cells within the area)
+            label_map = create_label_map(area_header, tile_directory, get_label_dtype(regions))
+
+            # keep track of cells with overlaps
+            overlaps = create_overlaps(label_map, regions, tile_directory)
+
+            # checkpoints of the map are saved while regions are added (and resumed from)
+            checkpoint = None
+            if checkpoint_directory is not None:
+                run_info = get_checkpoint_run_info(source, area_name, area_header, regions, 
+                                                   resample)
+                checkpoint, label_map = start_checkpoints(
+                    checkpoint_directory, float(get_job_option(job, "checkpoint_seconds")), 
+                    run_info, label_map, overlaps, bool(get_job_option(job, "resume")))
+
+            # go through each region and add to label_map
+            print(line_begin, "Making the regionalization map", line_end)
+            start = start_measure()
+            if tile_rows > 0:
+                each_region_tiled(source, regions, label_map, area_header, area_cell_info, 
+                                  overlaps, tile_rows, run_report)
+            else:
+                each_region(source, regions, label_map, area_header, area_cell_info, overlaps, 
+                            workers, run_report, resample, checkpoint)
+            add_stage(run_report, "make map", start, label_map.size, count_overlaps(overlaps))
+            if checkpoint is not None:
+                # the finished map, in case the program stops while saving the files
+                save_checkpoint(checkpoint, label_map, overlaps)
+
+        if profiler is not None:
+            profiler.disable()
+
+        if state_directory is not None:
+            start = start_measure()
+            save_state(state_directory, source, area_name, area_header, regions, label_map, 
+                       overlaps, save_names, old_state_info, resample)
+            add_stage(run_report, "save state", start)
+
+        # the map of the first overlap policy is saved as the map, 
+        # and the map of each other policy in its own csv file
+        policies = get_overlap_policies(job)
+        legend_regions = regions
+        if policies != ["last"]:
+            start = start_measure()
+            label_maps = resolve_overlaps(label_map, overlaps, regions, policies, 
+                                          get_job_option(job, "priority"), 
+                                          get_job_option(job, "conflict_value"))
+            add_stage(run_report, "resolve overlaps", start, label_map.size * len(policies))
+            label_map = label_maps[policies[0]]
+            if policies[0] == "conflict":
+                legend_regions = dict(regions)
+                conflict_value = get_conflict_value(regions, get_job_option(job, "conflict_value"))
+                legend_regions[conflict_value] = "overlap conflict"
+
+        # statistics of the values of other rasters in each region of the map
+        all_zonal_stats = None
+        if value_rasters:
+            print(line_begin, "Finding zonal statistics", line_end)
+            start = start_measure()
+            all_zonal_stats = get_all_zonal_stats(source, value_rasters, label_map, area_header, 
+                                                  legend_regions)
+            add_stage(run_report, "zonal statistics", start, label_map.size * len(value_rasters))
+        close_input_source(source)
+
+        # neighbouring regions of the map, and the length of their shared border
+        adjacency = None
+        if connectivity:
+            start = start_measure()
+            adjacency = get_adjacency(label_map, legend_regions, area_header["cellsize"], 
+                                      connectivity)
+            add_stage(run_report, "adjacency", start, label_map.size)
+
+        print(line_begin, "Saving files", line_end)
+        # save csv files and formatted map (blanks are set to nodata value of area)
+        save_files(label_map, area_header, area_header_labels, area_cell_info, legend_regions, 
+                   overlaps, save_wb_name, save_csv_names, format_map, overlaps_format, run_report, 
+                   output_directory, map_formats)
+        if all_zonal_stats is not None:
+            save_zonal_stats(all_zonal_stats, legend_regions, output_directory, run_report)
+        if adjacency is not None:
+            save_adjacency(adjacency, legend_regions, output_directory, run_report)
+        if preview_factors:
+            save_previews(label_map, area_header, area_header_labels, legend_regions, 
+                          preview_factors, preview_format, save_csv_names["map"], 
+                          output_directory, run_report)
+        if all_parents:
+            save_levels(label_map, area_header, area_header_labels, regions, all_parents, 
+                        save_csv_names, output_directory, run_report, tile_directory)
+        for policy in policies[1:]:
+            save_policy_map(label_maps[policy], area_header, area_header_labels, policy,
+                            save_csv_names, output_directory, run_report)
+
+        if profiler is not None:
+            print("Now saving profile to: " + profile_name)
+            profiler.dump_stats(os.path.join(output_directory, profile_name))
+        if run_report is not None:
+            print("Now saving run report to: " + run_report_name)
+            save_run_report(run_report, os.path.join(output_directory, run_report_name))
+
+        if checkpoint_directory is not None:
+            remove_checkpoints(checkpoint_directory)
+    finally:
+        if tile_directory is not None:
+            # the files of the map on disk are closed before their folder is removed
+            label_map = overlaps = None
+            shutil.rmtree(tile_directory, ignore_errors=True)
+    
+    return
 
-    # list to keep track of cells with overlaps
-    overlaps = []
-
-    # go through each region and add to map_ws
-    print(line_begin, "Making the regionalization map", line_end)
-    each_region(wb, regions, map_ws, area_header, area_cell_info, overlaps, xlFilename)   
 
-    # format map worksheet to have no data value, color scale, and smaller column width
-    format_map_ws(map_ws, area_ws, area_header, area_cell_info, format_map)
-    
-    # create legend
-    create_legend(legend_ws, regions)
+def main(argv=None):
+    start = start_measure()
 
-    #print overlaps
-    print_overlaps(overlaps_ws, overlaps)
+    # inputs come from the command line (or job file) if given, otherwise from the user
+    # (a job file that cannot be read, or is not a valid job, stops with an error)
+    try:
+        job = read_command_line(argv)
+    except (ValueError, OSError, ImportError) as error:
+        sys.exit("ERROR: " + str(error))
+    if job is None:
+        variables = define_all_variables()
+    else:
+        try:
+            variables = define_all_variables_from_job(job)
+        except ValueError as error:
+            sys.exit("ERROR: " + str(error))
 
-    print(line_begin, "Saving files", line_end)
-    # save workbook
-    save_files(wb, save_wb_name, save_csv_names, format_map)
-    
-    return
+    try:
+        make_and_save_map(variables, job, start)
+    except ValueError as error:
+        sys.exit("ERROR: " + str(error))
 
 
-main()
+if __name__ == "__main__":
+    main()
 
 
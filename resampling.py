@@ -0,0 +1,105 @@
+# resampling.py
+# The functions in script are called on by "regionalization.py"
+# They resample the mask of a region whose cellsize is not the same as the area,
+# so that the region lines up with the cells of the area before it is added to the map
+# Every cell of the area is mapped to cells of the region with index arrays
+# (no loops over cells), so large regions are resampled quickly
+
+import math
+import numpy as np
+
+# methods of resampling:
+#   nearest     --> a cell is part of the region if the region cell at its centre is
+#   majority    --> a cell is part of the region if at least half of it is covered by the region
+#                   (the region is sampled at a grid of points inside each cell)
+resample_methods = ("nearest", "majority")
+
+# relative difference below which two cellsizes are the same
+cellsize_tolerance = 1e-9
+
+
+##############################################################################
+# functions for resampling
+##############################################################################
+
+# returns True if the cellsize of a region header is the same as the area header
+def is_same_cellsize(region_header, area_header):
+    return math.isclose(region_header["cellsize"], area_header["cellsize"],
+                        rel_tol=cellsize_tolerance)
+
+# returns the header (same keys as get_file_header) of the region once resampled:
+# the cells of the area that the region covers (at least partly), with the cellsize of the area
+# the nodata_value is None, since the resampled values are nan outside of the region
+def get_resampled_header(region_header, area_header):
+    cellsize = area_header["cellsize"]
+    region_cellsize = region_header["cellsize"]
+
+    # columns and rows of the area (counted from its bottom left corner) at the region edges
+    first_col = math.floor((region_header["xllcorner"] - area_header["xllcorner"]) / cellsize +
+                           cellsize_tolerance)
+    last_col = math.ceil((region_header["xllcorner"] + region_header["ncols"] * region_cellsize -
+                          area_header["xllcorner"]) / cellsize - cellsize_tolerance)
+    first_row = math.floor((region_header["yllcorner"] - area_header["yllcorner"]) / cellsize +
+                           cellsize_tolerance)
+    last_row = math.ceil((region_header["yllcorner"] + region_header["nrows"] * region_cellsize -
+                          area_header["yllcorner"]) / cellsize - cellsize_tolerance)
+
+    resampled_header = {
+        "ncols"         :   max(last_col - first_col, 1),
+        "nrows"         :   max(last_row - first_row, 1),
+        "xllcorner"     :   area_header["xllcorner"] + first_col * cellsize,
+        "yllcorner"     :   area_header["yllcorner"] + first_row * cellsize,
+        "cellsize"      :   cellsize,
+        "nodata_value"  :   None
+    }
+    return resampled_header
+
+# returns the number of points sampled along each side of a cell for method
+# (enough that every region cell inside a cell of the area is sampled at least once)
+def get_samples_per_cell(region_header, resampled_header, method):
+    if method == "nearest":
+        return 1
+    ratio = resampled_header["cellsize"] / region_header["cellsize"]
+    return max(1, int(math.ceil(ratio - cellsize_tolerance)))
+
+# returns the index of the region column (or row) at each sample point,
+# with -1 where the point is outside of the region
+#   start           --> coordinate of the first edge of the resampled cells
+#   region_start    --> coordinate of the first edge of the region cells
+#   direction       --> 1 for columns (left to right), -1 for rows (top to bottom)
+def get_sample_indices(num_cells, samples, cellsize, start, region_cellsize, region_start,
+                       num_region_cells, direction):
+    # points are at (cell + (sample + 0.5) / samples) cells from the start
+    points = (np.arange(num_cells * samples) + 0.5) / samples
+    coords = start + direction * points * cellsize
+    indices = np.floor(direction * (coords - region_start) / region_cellsize).astype(np.int64)
+    indices[(indices < 0) | (indices >= num_region_cells)] = -1
+    return indices
+
+# returns the mask of a region (see get_region_mask) resampled to the cells of the area,
+# and the header of the resampled mask (see get_resampled_header)
+# method is one of resample_methods
+def resample_mask(mask, region_header, area_header, method):
+    resampled_header = get_resampled_header(region_header, area_header)
+    samples = get_samples_per_cell(region_header, resampled_header, method)
+    nrows, ncols = resampled_header["nrows"], resampled_header["ncols"]
+    cellsize = resampled_header["cellsize"]
+    region_cellsize = region_header["cellsize"]
+
+    cols = get_sample_indices(ncols, samples, cellsize, resampled_header["xllcorner"],
+                              region_cellsize, region_header["xllcorner"],
+                              region_header["ncols"], 1)
+    rows = get_sample_indices(nrows, samples, cellsize,
+                              resampled_header["yllcorner"] + nrows * cellsize, region_cellsize,
+                              region_header["yllcorner"] + region_header["nrows"] * region_cellsize,
+                              region_header["nrows"], -1)
+
+    # an extra False row and column, so that index -1 (outside of the region) is never in it
+    padded_mask = np.zeros((mask.shape[0] + 1, mask.shape[1] + 1), dtype=bool)
+    padded_mask[:-1, :-1] = mask
+    sampled = padded_mask[np.ix_(rows, cols)]
+    if samples == 1:
+        return sampled, resampled_header
+
+    counts = sampled.reshape(nrows, samples, ncols, samples).sum(axis=(1, 3), dtype=np.int32)
+    return 2 * counts >= samples * samples, resampled_header
@@ -0,0 +1,114 @@
+# run_report.py
+# The functions in script are called on by "regionalization.py"
+# They record the time, cells processed, memory (RSS) and overlaps of each stage of a run
+# and of each region, so that they can be saved as a json run report
+
+import os
+import sys
+import json
+import time
+
+
+##############################################################################
+# functions for measuring
+##############################################################################
+
+# returns the memory (RSS) used by this process now in megabytes, or None if unknown
+# on systems without /proc, the peak memory so far is returned instead
+def get_rss_megabytes():
+    try:
+        with open("/proc/self/statm", 'r') as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError: # not available on windows
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin": # bytes on macOS, kilobytes on linux
+        peak_rss /= 1024
+    return peak_rss / 1024
+
+
+# returns the start of a measurement (time and memory), used by add_stage and add_region
+def start_measure():
+    return time.perf_counter(), get_rss_megabytes()
+
+
+# returns the seconds and memory (and change in memory) since start (see start_measure)
+def end_measure(start):
+    start_time, start_rss = start
+    seconds = time.perf_counter() - start_time
+    rss = get_rss_megabytes()
+    rss_delta = None
+    if rss is not None and start_rss is not None:
+        rss_delta = rss - start_rss
+    return seconds, rss, rss_delta
+
+
+##############################################################################
+# functions for the run report
+##############################################################################
+
+# returns an empty run report, with the settings of the run
+def create_run_report(settings=None):
+    run_report = {
+        "started"   :   time.strftime("%Y-%m-%d %H:%M:%S"),
+        "settings"  :   dict(settings or {}),
+        "stages"    :   [],     # one record for each stage (reading, making the map, saving...)
+        "regions"   :   []      # one record for each region added to the map
+    }
+    return run_report
+
+
+# this function adds a record of a stage that began at start (see start_measure)
+# cells is the number of cells processed, overlaps the number of cells with overlaps
+# does nothing if run_report is None
+def add_stage(run_report, name, start, cells=0, overlaps=None):
+    if run_report is None:
+        return
+    seconds, rss, rss_delta = end_measure(start)
+    run_report["stages"].append({
+        "stage"         :   name,
+        "seconds"       :   seconds,
+        "cells"         :   int(cells),
+        "cells_per_second": cells / seconds if cells and seconds > 0 else None,
+        "rss_mb"        :   rss,
+        "rss_delta_mb"  :   rss_delta,
+        "overlaps"      :   overlaps
+    })
+
+
+# this function adds a record of a region that began at start (see start_measure)
+# cells is the number of cells in the region, overlaps the number of its cells that
+# were already part of an earlier region
+# seconds is added to the time since start (e.g. time spent reading in another process)
+# does nothing if run_report is None
+def add_region(run_report, name, start, cells, overlaps, seconds=0):
+    if run_report is None:
+        return
+    region_seconds, rss, rss_delta = end_measure(start)
+    region_seconds += seconds
+    run_report["regions"].append({
+        "region"        :   name,
+        "seconds"       :   region_seconds,
+        "cells"         :   int(cells),
+        "cells_per_second": cells / region_seconds if cells and region_seconds > 0 else None,
+        "rss_mb"        :   rss,
+        "rss_delta_mb"  :   rss_delta,
+        "overlaps"      :   int(overlaps)
+    })
+
+
+# this function saves the run report as a json file, with the total time of all stages,
+# the most memory used at the end of any stage,
+# and the slowest regions first in "slowest_regions"
+def save_run_report(run_report, filename):
+    run_report["total_seconds"] = sum(stage["seconds"] for stage in run_report["stages"])
+    run_report["max_rss_mb"] = max([stage["rss_mb"] for stage in run_report["stages"]
+                                    if stage["rss_mb"] is not None] or [None])
+    slowest = sorted(run_report["regions"], key=lambda region: region["seconds"], reverse=True)
+    run_report["slowest_regions"] = [region["region"] for region in slowest[:10]]
+    with open(filename, 'w') as file:
+        json.dump(run_report, file, indent=2)
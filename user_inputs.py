@@ -3,7 +3,11 @@
 # Created by Hannah Chan
 # Date: November 2020
 
-from openpyxl import load_workbook
+import os
+import argparse
+from asc_files import get_asc_names, read_list_file, to_number
+from input_cache import create_input_cache, load_cached_info, save_cached_info
+from resampling import resample_methods
 
 ##############################################################################
 # functions for interaction with user
@@ -120,10 +124,13 @@ def remove_regions(regions):
     return
  
 
-def sort_regions(regions, ws = None):
-    if ws is not None:
-        for row in ws.iter_rows():
-            regions[row[0].value] = row[1].value
+# list_rows are the values of the rows in sheet 'list' (or 'list.csv')
+def sort_regions(regions, list_rows = None):
+    if list_rows is not None:
+        for row in list_rows:
+            num = get_list_row_num(row)
+            if num is not None:
+                regions[num] = row[1]
 
     if regions == {}:
         print("There is no sheet 'list' in workbook.")
@@ -177,20 +184,69 @@ def print_explain_csv(save_csv_names):
     print("***Please note that this program will overwrite existing files.***")
 
 
+##############################################################################
+# default variables
+##############################################################################
+default_xlFilename = "individual_region_files.xlsx"
+default_save_csv_names = {
+    "map"       :"map.csv",
+    "legend"    :"legend.csv",
+    "overlaps"  :"overlaps.csv"
+}
+default_save_wb_name = "formatted_map.xlsx"
+# options that can only be given in a job file or on the command line
+default_job_options = {
+    "workers"           :   1,
+    "overlaps_format"   :   "cells",
+    "tile_rows"         :   0,
+    "tile_directory"    :   None,
+    "cache_directory"   :   None,
+    "cache_megabytes"   :   1024,
+    "state_directory"   :   None,
+    "run_report"        :   "run_report.json",
+    "profile"           :   None,
+    "output_directory"  :   "Outputs",
+    "overlap_policies"  :   ["last"],
+    "priority"          :   None,
+    "conflict_value"    :   None,
+    "validate"          :   "strict",
+    "resample"          :   "off",
+    "value_rasters"     :   [],
+    "adjacency"         :   0,
+    "map_formats"       :   ["csv"],
+    "preview_factors"   :   [],
+    "preview_format"    :   "png",
+    "checkpoint_directory": None,
+    "checkpoint_seconds":   600,
+    "resume"            :   False,
+    "levels"            :   []
+}
+# options that can be "off" (a .yaml job file reads a bare off as False)
+off_job_options = ("validate", "resample")
+overlaps_formats = ("cells", "runs", "pairs")
+overlap_policies = ("last", "first", "priority", "lowest", "highest", "conflict")
+validate_modes = ("strict", "warn", "off", "only")
+adjacency_connectivities = (0, 4, 8)
+map_formats = ("csv", "asc", "npy", "npz", "csv.gz", "csv.zst")
+preview_formats = ("png", "ppm", "xlsx")
+resample_options = ("off",) + resample_methods
+
+
 ##############################################################################
 # defining variables
 ##############################################################################
 
 
-def define_variable(variable_name, ws=None):
+def define_variable(variable_name, list_rows=None):
     line_end = "===================="
     line_begin = "\n" + line_end
 
     if variable_name == "xlFilename":
         print(line_begin, "input excel file", line_end)
-        xlFilename = "individual_region_files.xlsx"
+        xlFilename = default_xlFilename
         print("In the folder 'Outputs', " + 
               "the current input excel file name is '" + xlFilename + "'.")
+        print("(A folder with .asc files can also be used instead of an excel file)")
         change = y_or_n("Would you like to change the input file name")
         if change:
             xlFilename = answer("Please enter input excel filename")
@@ -207,19 +263,15 @@ def define_variable(variable_name, ws=None):
         print(line_begin, "regions", line_end)
         print("Define region names", 
               "(region names should be the same as excel sheet names)")
-        if ws is not None:
-            sort_regions(regions,ws)
+        if list_rows is not None:
+            sort_regions(regions, list_rows)
         else:
             sort_regions(regions)
         return regions
     
     elif variable_name == "save_csv_names":
         print(line_begin, "output CSV file names", line_end)
-        save_csv_names = {
-            "map"       :"map.csv",
-            "legend"    :"legend.csv",
-            "overlaps"  :"overlaps.csv"
-        }
+        save_csv_names = dict(default_save_csv_names)
         print_explain_csv(save_csv_names)
         change = y_or_n("Would you like to change csv names")
         if change:
@@ -228,7 +280,7 @@ def define_variable(variable_name, ws=None):
 
     elif variable_name == "save_wb_name":
         print(line_begin, "output excel workbook name", line_end)
-        save_wb_name = "formatted_map.xlsx"
+        save_wb_name = default_save_wb_name
         print("In the folder 'Outputs', " + 
               "the current input excel file name is '" + save_wb_name + "'.")
         change = y_or_n("***Please note that this program will overwrite the existing file***" + 
@@ -242,18 +294,111 @@ def define_variable(variable_name, ws=None):
         print("Problem: variable name does not exist")
         return('')
 
-def load_input_workbook(xlFilename):
-    print("Now loading workbook: " + xlFilename)
-    wb = load_workbook(xlFilename)
-    print("Finished loading workbook: " + xlFilename)
+# the workbook is opened in read-only mode, so sheets are streamed
+# (using iter_rows) instead of being loaded into memory all at once
+# openpyxl is only imported here, so that it is not needed for .asc files
+def load_input_workbook(xlFilename, quiet=False):
+    from openpyxl import load_workbook
+    if not quiet:
+        print("Now loading workbook: " + xlFilename)
+    wb = load_workbook(xlFilename, read_only=True)
+    if not quiet:
+        print("Finished loading workbook: " + xlFilename)
     return wb
 
+# returns a dictionary describing where the area and regions are read from:
+# either an excel workbook (one sheet per .asc file) or
+# a folder of .asc files (one file per sheet, 'list.csv' instead of sheet 'list')
+# if input_cache is given (see input_cache.py), sheets that were read before
+# are taken from the cache, and the workbook is only loaded when a sheet is not
+def load_input_source(xlFilename, quiet=False, input_cache=None):
+    if os.path.isdir(xlFilename):
+        if not quiet:
+            print("Now reading folder of .asc files: " + xlFilename)
+        asc_filenames = get_asc_names(xlFilename)
+        sheetnames = list(asc_filenames)
+        if os.path.isfile(os.path.join(xlFilename, "list.csv")):
+            sheetnames.append("list")
+        source = {
+            "name"          :   xlFilename,
+            "wb"            :   None,
+            "directory"     :   xlFilename,
+            "sheetnames"    :   sheetnames,
+            "asc_filenames" :   asc_filenames,
+            "cache"         :   input_cache,
+            "quiet"         :   quiet
+        }
+        return source
+
+    source = {
+        "name"          :   xlFilename,
+        "wb"            :   None,
+        "directory"     :   None,
+        "sheetnames"    :   None,
+        "cache"         :   input_cache,
+        "quiet"         :   quiet
+    }
+    if input_cache is not None:
+        source["sheetnames"] = load_cached_info(input_cache, xlFilename, "sheetnames")
+    if source["sheetnames"] is None:
+        source["sheetnames"] = get_source_workbook(source).sheetnames
+        if input_cache is not None:
+            save_cached_info(input_cache, xlFilename, "sheetnames", source["sheetnames"])
+    elif not quiet:
+        print("Using sheet names of workbook '" + xlFilename + "' from the input cache")
+    return source
+
+# returns the input workbook of the source, loading it the first time it is needed
+def get_source_workbook(source):
+    if source["wb"] is None:
+        source["wb"] = load_input_workbook(source["name"], source["quiet"])
+    return source["wb"]
+
+# closes the input workbook (read-only workbooks keep the file open)
+def close_input_source(source):
+    if source["wb"] is not None:
+        source["wb"].close()
+        source["wb"] = None
+
+# returns the region number of a row of sheet 'list' (see read_list_rows),
+# or None if it is not a number (e.g. a title row or a blank row, which are skipped)
+def get_list_row_num(row):
+    if len(row) < 2 or isinstance(row[0], bool):
+        return None
+    if isinstance(row[0], (int, float)):
+        return row[0]
+    try:
+        return to_number(str(row[0]).strip())
+    except ValueError:
+        return None
+
+# returns the values of each row of sheet 'list' (or 'list.csv'): region number, region name,
+# then the parents of the region, if any (see get_region_parents)
+def read_list_rows(source):
+    if source["directory"] is not None:
+        return read_list_file(os.path.join(source["directory"], "list.csv"))
+    if source["cache"] is not None:
+        list_rows = load_cached_info(source["cache"], source["name"], "list rows")
+        if list_rows is None:
+            list_rows = [list(row) for row in get_source_workbook(source)["list"].iter_rows(
+                            min_col=1, values_only=True)]
+            save_cached_info(source["cache"], source["name"], "list rows", list_rows)
+        return list_rows
+    return get_source_workbook(source)["list"].iter_rows(min_col=1, values_only=True)
+
+# returns the input cache (see input_cache.py) from the job, or None if it is not used
+def get_input_cache(job):
+    cache_directory = get_job_option(job, "cache_directory")
+    if cache_directory is None:
+        return None
+    return create_input_cache(cache_directory, float(get_job_option(job, "cache_megabytes")))
+
 # Returns all variables
 def define_all_variables():
 
     # define variables
     xlFilename = define_variable("xlFilename")
-    wb = load_input_workbook(xlFilename)
+    source = load_input_source(xlFilename)
 
     save_csv_names = define_variable("save_csv_names")
     format_map = y_or_n("\nShould the regionalized map also be formatted" + 
@@ -269,14 +414,500 @@ def define_all_variables():
 
     while True:
         area_name = define_variable("area_name")
-        if area_name not in wb.sheetnames:
+        if area_name not in source["sheetnames"]:
             print("ERROR: No sheet with this name was found")
         else:
             break
 
-    if 'list' not in wb.sheetnames:
+    if 'list' not in source["sheetnames"]:
         regions = define_variable("regions")
     else:
-        regions = define_variable("regions", wb["list"])
+        regions = define_variable("regions", read_list_rows(source))
+
+    return xlFilename, source, save_csv_names, format_map, save_wb_name, area_name, regions
+
+
+##############################################################################
+# defining variables without interaction (job file and command line)
+##############################################################################
+
+# keys that can be used in a job file
+job_keys = ("input", "area_name", "regions", "save_csv_names", "format_map", "save_wb_name",
+            "workers", "overlaps_format", "tile_rows", "tile_directory", "cache_directory",
+            "cache_megabytes", "state_directory", "run_report", "profile", "output_directory", 
+            "overlap_policies", "priority", "conflict_value", "validate", "resample", 
+            "value_rasters", "adjacency", "map_formats", "preview_factors", "preview_format", 
+            "checkpoint_directory", "checkpoint_seconds", "resume", "levels")
+
+
+# returns the dictionary in a job file (.json, .toml, .yaml or .yml)
+# raises a ValueError if the file cannot be read as a job
+def load_job_file(job_filename):
+    extension = os.path.splitext(job_filename)[1].lower()
+    if extension == ".json":
+        import json
+        with open(job_filename, 'r') as file:
+            try:
+                job = json.load(file)
+            except ValueError as error:
+                raise ValueError("Job file '" + job_filename + "' is not valid json: " + str(error))
+    elif extension == ".toml":
+        try:
+            import tomllib
+        except ImportError: # python < 3.11
+            import tomli as tomllib
+        with open(job_filename, 'rb') as file:
+            try:
+                job = tomllib.load(file)
+            except ValueError as error:
+                raise ValueError("Job file '" + job_filename + "' is not valid toml: " + str(error))
+    elif extension in (".yaml", ".yml"):
+        try:
+            import yaml
+        except ImportError:
+            raise ImportError("The package 'pyyaml' is needed to read job file '" + 
+                              job_filename + "'")
+        with open(job_filename, 'r') as file:
+            try:
+                job = yaml.safe_load(file) or {}
+            except yaml.YAMLError as error:
+                raise ValueError("Job file '" + job_filename + "' is not valid yaml: " + str(error))
+    else:
+        raise ValueError("Job file '" + job_filename + 
+                         "' must be a .json, .toml, .yaml or .yml file")
+
+    if not isinstance(job, dict):
+        raise ValueError("Job file '" + job_filename + "' does not contain a dictionary")
+    return job
+
+
+# returns the regions dictionary from the 'regions' of a job
+# regions can be a dictionary {number: name} or a list of [number, name] pairs
+def get_job_regions(job_regions):
+    if isinstance(job_regions, dict):
+        job_regions = job_regions.items()
+    regions = {}
+    for num, name in job_regions:
+        if isinstance(num, str):
+            num = to_number(num)
+        regions[num] = name
+    return regions
+
+
+# returns True if num can be kept in the map: a whole number, larger than the smallest
+# 64-bit integer (which is kept for cells with no region)
+def is_map_number(num):
+    return (not isinstance(num, bool) and isinstance(num, (int, float)) and 
+            float(num).is_integer() and -2**63 < num < 2**63)
+
+
+# this function checks that every region number can be kept in the map (see is_map_number)
+# raises a ValueError for the first region number that cannot
+def check_region_nums(regions):
+    for num in regions:
+        if not is_map_number(num):
+            raise ValueError("Region number " + str(num) + " of region '" + str(regions[num]) + 
+                             "' must be a whole number")
+
+
+# this function checks the conflict_value of the overlap policy "conflict" (None is the default,
+# see get_conflict_value in "regionalization.py"): a whole number that is not a region number
+# raises a ValueError if it is not
+def check_conflict_value(conflict_value, regions):
+    if conflict_value is None:
+        return
+    if not is_map_number(conflict_value):
+        raise ValueError("'conflict_value' must be a whole number")
+    if conflict_value in regions:
+        raise ValueError("'conflict_value' cannot be the number of region '" + 
+                         str(regions[conflict_value]) + "'")
+
+
+# returns the regions dictionary: from the sheet 'list' of the source if job_regions 
+# is 'list', otherwise from job_regions (see get_job_regions)
+# raises a ValueError if there is no sheet 'list', or a region number is not a whole number
+def get_source_regions(source, job_regions):
+    if job_regions != "list":
+        regions = get_job_regions(job_regions)
+    else:
+        if 'list' not in source["sheetnames"]:
+            raise ValueError("There is no sheet 'list' in '" + source["name"] + "'")
+        regions = {}
+        for row in read_list_rows(source):
+            num = get_list_row_num(row)
+            if num is not None:
+                regions[num] = row[1]
+    check_region_nums(regions)
+    return regions
+
+
+# returns the parent of each region at each of levels (names of aggregation levels, e.g.
+# province), as a dictionary level --> {region number: parent name}
+# the parents are in the columns after the region name in the sheet 'list' (one column for 
+# each level, in the same order as levels), regions with a blank parent are not in any 
+# region at that level
+# raises a ValueError if there is no sheet 'list', or a level has no parents
+def get_region_parents(source, levels):
+    if 'list' not in source["sheetnames"]:
+        raise ValueError("There is no sheet 'list' in '" + source["name"] + "'")
+    parents = {level: {} for level in levels}
+    for row in read_list_rows(source):
+        num = get_list_row_num(row)
+        if num is None:
+            continue
+        for column, level in enumerate(levels, 2):
+            if column < len(row) and row[column] not in (None, ""):
+                parents[level][num] = row[column]
+    for column, level in enumerate(levels, 3):
+        if not parents[level]:
+            raise ValueError("There are no parents for level '" + level + "' in column " + 
+                             str(column) + " of sheet 'list'")
+    return parents
+
+
+# Returns all variables (same as define_all_variables), but from a job dictionary
+# instead of from the user. Problems with the job raise a ValueError.
+def define_all_variables_from_job(job):
+    for key in job:
+        if key not in job_keys:
+            raise ValueError("'" + key + "' is not a job key (keys are: " + 
+                             ", ".join(job_keys) + ")")
+
+    xlFilename = job.get("input", default_xlFilename)
+    if not os.path.exists(xlFilename):
+        raise ValueError("Input file '" + xlFilename + "' does not exist")
+
+    save_csv_names = dict(default_save_csv_names)
+    for name in job.get("save_csv_names") or {}:
+        if name not in save_csv_names:
+            raise ValueError("'" + name + "' is not a csv file ('map', 'legend', or 'overlaps')")
+        save_csv_names[name] = job["save_csv_names"][name]
+
+    if get_job_option(job, "overlaps_format") not in overlaps_formats:
+        raise ValueError("'overlaps_format' must be one of: " + ", ".join(overlaps_formats))
+
+    if job.get("state_directory") is not None and job.get("tile_rows"):
+        raise ValueError("'state_directory' cannot be used together with 'tile_rows'")
+    if job.get("workers") not in (None, 1) and job.get("tile_rows"):
+        raise ValueError("'workers' cannot be used together with 'tile_rows' " + 
+                         "(a tiled map is made with one process)")
+
+    if job.get("checkpoint_directory") is not None and job.get("tile_rows"):
+        raise ValueError("'checkpoint_directory' cannot be used together with 'tile_rows'")
+    if job.get("resume") and job.get("checkpoint_directory") is None:
+        raise ValueError("'resume' needs a 'checkpoint_directory' to resume from")
+    if float(get_job_option(job, "checkpoint_seconds")) < 0:
+        raise ValueError("'checkpoint_seconds' cannot be less than 0")
+
+    levels = get_levels(job)
+    if levels and job.get("regions", "list") != "list":
+        raise ValueError("'levels' needs the regions (and their parents) from the sheet 'list'")
+    if len(set(levels)) != len(levels):
+        raise ValueError("'levels' cannot have the same level more than once")
+
+    if get_job_option(job, "validate") not in validate_modes:
+        raise ValueError("'validate' must be one of: " + ", ".join(validate_modes))
+
+    if get_job_option(job, "resample") not in resample_options:
+        raise ValueError("'resample' must be one of: " + ", ".join(resample_options))
+    if get_job_option(job, "resample") != "off" and job.get("tile_rows"):
+        raise ValueError("'resample' cannot be used together with 'tile_rows'")
+
+    if get_job_option(job, "adjacency") not in adjacency_connectivities:
+        raise ValueError("'adjacency' must be one of: " + 
+                         ", ".join(str(connectivity) for connectivity in adjacency_connectivities))
+
+    check_map_formats(get_map_formats(job))
+
+    try:
+        preview_factors = get_preview_factors(job)
+    except (TypeError, ValueError):
+        preview_factors = [0]
+    if any(factor < 1 for factor in preview_factors):
+        raise ValueError("'preview_factors' must be whole numbers of 1 or more")
+    if get_job_option(job, "preview_format") not in preview_formats:
+        raise ValueError("'preview_format' must be one of: " + ", ".join(preview_formats))
+
+    policies = get_overlap_policies(job)
+    for policy in policies:
+        if policy not in overlap_policies:
+            raise ValueError("'" + str(policy) + "' is not an overlap policy (policies are: " + 
+                             ", ".join(overlap_policies) + ")")
+    if "priority" in policies and not job.get("priority"):
+        raise ValueError("The overlap policy 'priority' needs a 'priority' list of regions")
+    if policies != ["last"] and (job.get("tile_rows") or job.get("state_directory") is not None):
+        raise ValueError("Overlap policies other than 'last' cannot be used together with " + 
+                         "'tile_rows' or 'state_directory'")
+
+    format_map = bool(job.get("format_map", False))
+    save_wb_name = ''
+    if format_map:
+        save_wb_name = job.get("save_wb_name") or default_save_wb_name
+        if xlFilename == save_wb_name:
+            raise ValueError("filename to save to cannot be the same as original workbook")
+
+    area_name = job.get("area_name")
+    if area_name is None:
+        raise ValueError("No 'area_name' was given")
+
+    source = load_input_source(xlFilename, input_cache=get_input_cache(job))
+    if area_name not in source["sheetnames"]:
+        close_input_source(source)
+        raise ValueError("No sheet with name '" + area_name + "' was found")
+
+    try:
+        regions = get_source_regions(source, job.get("regions", "list"))
+        check_conflict_value(job.get("conflict_value"), regions)
+    except ValueError:
+        close_input_source(source)
+        raise
+
+    return xlFilename, source, save_csv_names, format_map, save_wb_name, area_name, regions
+
+
+# returns an option from the job, or its default (see default_job_options)
+def get_job_option(job, key):
+    if job is None or job.get(key) is None:
+        return default_job_options[key]
+    if job[key] is False and key in off_job_options:
+        return "off"
+    return job[key]
+
+
+# returns the list of overlap policies of the job (the first is used for the map)
+# policies can be given as a list, or as one string with commas between them
+def get_overlap_policies(job):
+    policies = get_job_option(job, "overlap_policies")
+    if isinstance(policies, str):
+        policies = [policy.strip() for policy in policies.split(",")]
+    return list(policies)
+
+
+# returns the list of names of value rasters of the job (see get_zonal_stats)
+# names can be given as a list, or as one string with commas between them
+def get_value_rasters(job):
+    value_rasters = get_job_option(job, "value_rasters")
+    if isinstance(value_rasters, str):
+        value_rasters = [name.strip() for name in value_rasters.split(",") if name.strip()]
+    return list(value_rasters)
+
+
+# returns the list of names of aggregation levels of the job (see get_region_parents)
+# names can be given as a list, or as one string with commas between them
+def get_levels(job):
+    levels = get_job_option(job, "levels")
+    if isinstance(levels, str):
+        levels = [level.strip() for level in levels.split(",") if level.strip()]
+    return [str(level) for level in levels]
+
+
+# returns the list of formats to save the map in (see map_formats)
+# formats can be given as a list, or as one string with commas between them
+def get_map_formats(job):
+    job_map_formats = get_job_option(job, "map_formats")
+    if isinstance(job_map_formats, str):
+        job_map_formats = [map_format.strip() for map_format in job_map_formats.split(",")]
+    return list(job_map_formats)
+
+
+# returns the list of zoom factors of the previews of the job (see save_previews)
+# factors can be given as a list, or as one string with commas between them
+def get_preview_factors(job):
+    preview_factors = get_job_option(job, "preview_factors")
+    if isinstance(preview_factors, (str, int)):
+        preview_factors = [factor for factor in str(preview_factors).split(",") if factor.strip()]
+    return [int(factor) for factor in preview_factors]
+
+
+# this function checks a list of formats to save the map in (see map_formats)
+# raises a ValueError if there are none, one is not a map format, or one cannot be saved
+def check_map_formats(job_map_formats):
+    if not job_map_formats:
+        raise ValueError("'map_formats' must have at least one format")
+    for map_format in job_map_formats:
+        if map_format not in map_formats:
+            raise ValueError("'" + str(map_format) + "' is not a map format (formats are: " + 
+                             ", ".join(map_formats) + ")")
+    if "csv.zst" in job_map_formats and not can_use_zstd():
+        raise ValueError("The package 'zstandard' (or python 3.14 or later) is needed " + 
+                         "to save the map as 'csv.zst'")
+
+
+# returns True if maps can be saved with zstandard compression
+# (python 3.14 or later, or the package 'zstandard')
+def can_use_zstd():
+    for module_name in ("compression.zstd", "zstandard"):
+        try:
+            __import__(module_name)
+            return True
+        except ImportError:
+            pass
+    return False
+
+
+# returns the number of worker processes for reading regions (1 if not given)
+def get_workers(job):
+    workers = int(get_job_option(job, "workers"))
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    return workers
+
+
+# returns the regions dictionary from a command line argument,
+# e.g. "1=BC,2=AB" (or "list" to use the sheet 'list')
+def parse_regions_argument(argument):
+    if argument == "list":
+        return argument
+    regions = {}
+    for region in argument.split(","):
+        num, sep, name = region.partition("=")
+        if sep == "" or name.strip() == "":
+            raise argparse.ArgumentTypeError("'" + region + 
+                                             "' is not in the form number=name")
+        try:
+            regions[to_number(num.strip())] = name.strip()
+        except ValueError:
+            raise argparse.ArgumentTypeError("'" + num + "' is not a region number")
+    return regions
+
+
+# returns the parser for the command line
+def get_argument_parser():
+    parser = argparse.ArgumentParser(
+        description="Create a regionalized map from an excel workbook or a folder of .asc files. " +
+                    "Without any arguments, all inputs are asked for in the command line.")
+    parser.add_argument("--job", 
+                        help="job file (.json, .toml, .yaml or .yml) with the inputs")
+    parser.add_argument("--input", 
+                        help="input excel workbook or folder of .asc files")
+    parser.add_argument("--area-name", dest="area_name", 
+                        help="name of the sheet (or .asc file) of the entire area")
+    parser.add_argument("--regions", type=parse_regions_argument,
+                        help="'list' to use the sheet 'list', or regions as number=name pairs, " +
+                             "e.g. 1=BC,2=AB")
+    for name in default_save_csv_names:
+        parser.add_argument("--" + name + "-csv", dest=name + "_csv",
+                            help="output csv file name for " + name)
+    parser.add_argument("--format-map", dest="format_map", action="store_true", default=None,
+                        help="also save the formatted map as an excel workbook")
+    parser.add_argument("--no-format-map", dest="format_map", action="store_false",
+                        help="do not save the formatted map")
+    parser.add_argument("--wb-name", dest="save_wb_name",
+                        help="output excel workbook file name for the formatted map")
+    parser.add_argument("--overlaps-format", dest="overlaps_format", choices=overlaps_formats,
+                        help="what is saved for overlaps: every cell (default), " + 
+                             "runs of cells in each row, or totals for each pair of regions")
+    parser.add_argument("--validate", choices=validate_modes,
+                        help="check the headers of the area and all regions first: stop if " + 
+                             "there are errors (strict, default), only print them (warn), " + 
+                             "do not check (off), or only check and do not make the map (only)")
+    parser.add_argument("--resample", choices=resample_options,
+                        help="resample regions with a different cellsize than the area to the " + 
+                             "cells of the area: by the region cell at the centre of each cell " + 
+                             "(nearest), or by what covers at least half of each cell " + 
+                             "(majority); default off (a different cellsize is an error)")
+    parser.add_argument("--value-rasters", dest="value_rasters",
+                        help="sheets (or .asc files) on the same cells as the area, with commas " + 
+                             "between them; the sum, mean, min and max of their values in each " + 
+                             "region are saved in zonal_stats.csv")
+    parser.add_argument("--adjacency", type=int, choices=adjacency_connectivities,
+                        help="save the neighbouring regions and the length of their shared " + 
+                             "border in adjacency.csv: cells are neighbours if they share an " + 
+                             "edge (4) or an edge or corner (8); default 0 (not saved)")
+    parser.add_argument("--map-formats", dest="map_formats",
+                        help="formats to save the map in, with commas between them: " + 
+                             ", ".join(map_formats) + " (default csv; csv.zst needs the " + 
+                             "package 'zstandard')")
+    parser.add_argument("--preview-factors", dest="preview_factors",
+                        help="save a small preview of the map for each of these zoom factors, " + 
+                             "with commas between them (e.g. 4,16,64: one cell for every " + 
+                             "4 x 4 cells of the map...)")
+    parser.add_argument("--preview-format", dest="preview_format", choices=preview_formats,
+                        help="format of the previews: png (default), ppm, or xlsx " + 
+                             "(a formatted map)")
+    parser.add_argument("--levels",
+                        help="names of aggregation levels (e.g. province,interconnection), " + 
+                             "with commas between them; the parent of each region at each " + 
+                             "level is in the columns after the region name in sheet 'list', " + 
+                             "and a map and legend are saved for each level")
+    parser.add_argument("--overlap-policies", dest="overlap_policies",
+                        help="which region is kept in cells with more than one region: " + 
+                             ", ".join(overlap_policies) + " (default last); several " + 
+                             "policies with commas between them also save a map for each")
+    parser.add_argument("--priority", type=lambda argument: argument.split(","),
+                        help="region names or numbers with commas between them, highest " + 
+                             "priority first (for the overlap policy 'priority')")
+    parser.add_argument("--conflict-value", dest="conflict_value", type=to_number,
+                        help="value of cells with more than one region (for the overlap " + 
+                             "policy 'conflict'), a whole number that is not a region number " + 
+                             "(default one more than the largest region number)")
+    parser.add_argument("--tile-rows", dest="tile_rows", type=int,
+                        help="make the map in bands of this many rows, with the map kept " + 
+                             "on disk (for maps larger than memory, default 0 = not tiled)")
+    parser.add_argument("--tile-directory", dest="tile_directory",
+                        help="folder for the temporary files of a tiled map " + 
+                             "(default is the system temporary folder)")
+    parser.add_argument("--cache-directory", dest="cache_directory",
+                        help="folder to keep parsed input sheets in, so that later runs " + 
+                             "with the same input file do not parse it again")
+    parser.add_argument("--cache-megabytes", dest="cache_megabytes", type=float,
+                        help="largest size of the cache folder, the least recently used " + 
+                             "sheets are removed first (default 1024)")
+    parser.add_argument("--state-directory", dest="state_directory",
+                        help="folder to save the finished map in; if a map was saved there " + 
+                             "before, only regions that changed since then are made again")
+    parser.add_argument("--checkpoint-directory", dest="checkpoint_directory",
+                        help="folder to save checkpoints of the map in while regions are added, " + 
+                             "so that a run that stops part way can be resumed (see --resume)")
+    parser.add_argument("--checkpoint-seconds", dest="checkpoint_seconds", type=float,
+                        help="least seconds between checkpoints (default 600, 0 to save one " + 
+                             "after every region)")
+    parser.add_argument("--resume", action="store_true", default=None,
+                        help="resume from the last checkpoint in the checkpoint folder, " + 
+                             "instead of making the map from the start")
+    parser.add_argument("--output-directory", dest="output_directory",
+                        help="folder to save all output files in (default Outputs)")
+    parser.add_argument("--run-report", dest="run_report",
+                        help="file name in the output folder for the json run report with the time, " + 
+                             "cells and memory of each stage and region (default run_report.json)")
+    parser.add_argument("--no-run-report", dest="run_report", action="store_const", const="",
+                        help="do not save the run report")
+    parser.add_argument("--profile",
+                        help="profile the making of the map with cProfile, and save it " + 
+                             "with this file name in the output folder (e.g. profile.prof)")
+    parser.add_argument("--workers", type=int,
+                        help="number of processes used to read regions " + 
+                             "(default 1, 0 to use all cpus)")
+    return parser
+
+
+# returns the job dictionary from the command line arguments (job file first,
+# then any other arguments override it), or None if no arguments were given
+# (then the user is asked for all inputs instead)
+def read_command_line(argv=None):
+    args = get_argument_parser().parse_args(argv)
+
+    job = {}
+    if args.job is not None:
+        job = load_job_file(args.job)
+
+    for key in ("input", "area_name", "regions", "format_map", "save_wb_name", "workers",
+                "overlaps_format", "tile_rows", "tile_directory", "cache_directory", 
+                "cache_megabytes", "state_directory", "run_report", "profile", 
+                "output_directory", "overlap_policies", "priority", "conflict_value", 
+                "validate", "resample", "value_rasters", "adjacency", "map_formats", 
+                "preview_factors", "preview_format", "checkpoint_directory", 
+                "checkpoint_seconds", "resume", "levels"):
+        if getattr(args, key) is not None:
+            job[key] = getattr(args, key)
+
+    save_csv_names = dict(job.get("save_csv_names") or {})
+    for name in default_save_csv_names:
+        if getattr(args, name + "_csv") is not None:
+            save_csv_names[name] = getattr(args, name + "_csv")
+    if save_csv_names:
+        job["save_csv_names"] = save_csv_names
 
-    return xlFilename, wb, save_csv_names, format_map, save_wb_name, area_name, regions
+    if args.job is None and not job:
+        return None
+    return job